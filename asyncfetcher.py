@@ -0,0 +1,149 @@
+import asyncio
+import time
+import uuid
+from typing import Dict, Iterable, List, Tuple
+from urllib.parse import quote
+
+import aiohttp
+import httplib2
+from google.auth.transport.requests import Request
+from googleapiclient.errors import HttpError
+
+from .fetcher import CALENDAR_FIELDS, CalendarFetcher
+
+
+API_URL = 'https://www.googleapis.com/calendar/v3'
+
+
+class AsyncCalendarFetcher(CalendarFetcher):
+    def __init__(self, credentials, calendar_list_ttl: int = 3600, horizon: int = 24 * 60 * 60,
+                 base_url: str = API_URL, max_connections: int = 10):
+        """Same as the CalendarFetcher, but talks to the Google Calendar API with aiohttp instead of googleapiclient.
+
+        All methods are coroutines which run on the event loop, the calendars are fetched concurrently over a pool
+        of keep-alive connections instead of one batch request. Errors are raised as googleapiclient HttpErrors,
+        so they can be handled the same way.
+
+        :param credentials: google.auth credentials, the access token is refreshed when it expires
+        :param base_url: address of the calendar API, e.g. of a FakeCalendarServer
+        :param max_connections: maximum amount of concurrent connections to the API
+        """
+        super().__init__(None, batch_requests=False, calendar_list_ttl=calendar_list_ttl, horizon=horizon)
+        self.credentials = credentials
+        self.base_url = base_url.rstrip('/')
+        self.max_connections = max_connections
+
+        self._session = None
+        self._credentials_lock = asyncio.Lock()
+
+    async def fetch(self, calendar_ids: Iterable[str] = None,
+                    commit: bool = True) -> List[Tuple[Dict, List[Dict], bool]]:
+        """See CalendarFetcher.fetch"""
+        self._discard_staged()
+        calendar_infos = await self.list_calendars()
+        if calendar_ids is None:
+            calendar_ids = [calendar_info['id'] for calendar_info in calendar_infos]
+            for calendar_id in set(self.sync_tokens) - set(calendar_ids):
+                self.sync_tokens.pop(calendar_id)
+                self.horizon_ends.pop(calendar_id, None)
+        else:
+            calendar_infos = [calendar_info for calendar_info in calendar_infos if calendar_info['id'] in calendar_ids]
+            calendar_ids = [calendar_info['id'] for calendar_info in calendar_infos]
+
+        # every calendar finishes before a failure is raised, nothing stages sync tokens after the fetch returned
+        synced = await asyncio.gather(*(self._sync_calendar(calendar_id) for calendar_id in calendar_ids),
+                                      return_exceptions=True)
+        for result in synced:
+            if isinstance(result, Exception):
+                self._discard_staged()
+                raise result
+
+        if commit:
+            self.commit()
+        return [(calendar_info, *result) for calendar_info, result in zip(calendar_infos, synced)]
+
+    async def list_calendars(self) -> List[Dict]:
+        """See CalendarFetcher.list_calendars"""
+        if time.monotonic() < self.calendar_list_expires:
+            return self.calendars
+
+        headers = {'If-None-Match': self.calendar_list_etag} if self.calendar_list_etag else {}
+        try:
+            result = await self._request('GET', '/users/me/calendarList', headers=headers)
+        except HttpError as error:
+            if error.resp.status != 304:
+                raise
+        else:
+            self.calendars = [{key: calendar_info[key] for key in CALENDAR_FIELDS if key in calendar_info}
+                              for calendar_info in result['items']]
+            self.calendar_list_etag = result.get('etag')
+
+        self.calendar_list_expires = time.monotonic() + self.calendar_list_ttl
+        return self.calendars
+
+    async def watch(self, calendar_id: str, address: str, token: str, ttl: int) -> Dict:
+        body = {'id': str(uuid.uuid4()), 'type': 'web_hook', 'address': address, 'token': token,
+                'params': {'ttl': str(ttl)}}
+        return await self._request('POST', f'/calendars/{quote(calendar_id)}/events/watch', json=body)
+
+    async def stop_channel(self, channel: Dict) -> None:
+        await self._request('POST', '/channels/stop', json={'id': channel['id'], 'resourceId': channel['resourceId']})
+
+    async def close(self) -> None:
+        if self._session:
+            await self._session.close()
+            self._session = None
+
+    async def _sync_calendar(self, calendar_id: str) -> Tuple[List[Dict], bool]:
+        """See CalendarFetcher._sync_calendar, the jobs of a calendar run concurrently"""
+        jobs = self._jobs(calendar_id)
+        results = await asyncio.gather(*(self._run_job(calendar_id, params) for _, params, _ in jobs),
+                                       return_exceptions=True)
+
+        for (kind, _, _), result in zip(jobs, results):
+            if isinstance(result, Exception):
+                if kind != 'sync' or not self._sync_token_expired(calendar_id, result):
+                    raise result
+                # the edge is part of the full sync
+                return await self._sync_calendar(calendar_id)
+
+        # the sync state is only updated once all jobs of the calendar succeeded
+        raw_entries = []
+        for (kind, _, window_end), (job_entries, last_page) in zip(jobs, results):
+            raw_entries.extend(job_entries)
+            self._complete(calendar_id, kind, last_page, window_end)
+        return raw_entries, any(kind == 'full' for kind, _, _ in jobs)
+
+    async def _run_job(self, calendar_id: str, params: Dict) -> Tuple[List[Dict], Dict]:
+        """Fetches all pages of a request, returns the entries and the last page"""
+        raw_entries = []
+        page_token = None
+        while True:
+            query = dict(params, singleEvents='true')
+            if page_token:
+                query['pageToken'] = page_token
+            result = await self._request('GET', f'/calendars/{quote(calendar_id)}/events', params=query)
+            raw_entries.extend(result.get('items', []))
+            page_token = result.get('nextPageToken')
+            if not page_token:
+                return raw_entries, result
+
+    async def _request(self, method: str, path: str, **kwargs) -> Dict:
+        if self._session is None:
+            self._session = aiohttp.ClientSession(connector=aiohttp.TCPConnector(limit=self.max_connections))
+
+        headers = kwargs.pop('headers', {})
+        await self._apply_credentials(headers)
+        self.round_trips += 1
+        async with self._session.request(method, self.base_url + path, headers=headers, **kwargs) as response:
+            content = await response.read()
+            if response.status >= 300:
+                raise HttpError(httplib2.Response({'status': response.status}), content, uri=str(response.url))
+            return await response.json() if content else {}
+
+    async def _apply_credentials(self, headers: Dict) -> None:
+        """Adds the access token to the headers, an expired token is refreshed once for all waiting requests"""
+        async with self._credentials_lock:
+            if not self.credentials.valid:
+                await asyncio.get_running_loop().run_in_executor(None, self.credentials.refresh, Request())
+        self.credentials.apply(headers)
@@ -0,0 +1,284 @@
+"""Offline benchmarks of the calendar pipeline.
+
+Synthetic semesters are replayed against a FakeCalendarService and fake Discord channels, every stage of a refresh
+is timed and its allocations and Discord calls are counted. Nothing goes over the network.
+
+Run from the directory containing the cog package::
+
+    python -m eitcogs.benchmark
+    python -m eitcogs.benchmark --scenarios 10x100 500x10000 --no-allocations
+"""
+import argparse
+import asyncio
+import datetime
+import itertools
+import random
+import time
+import timeit
+import tracemalloc
+from types import SimpleNamespace
+from typing import Dict, List, Tuple
+
+import dateutil.parser
+import discord
+
+from .calendar import CalendarManager, GoogleCalendar, parse_datetime, reformat_timedelta
+from .fakeservice import FakeCalendarService, fake_entry
+
+
+SCENARIOS = ((10, 100), (50, 1000), (100, 5000), (500, 10000))
+
+
+def entry_corpus(size: int = 1000, seed: int = 0) -> List[Dict]:
+    """Raw entries shaped like the ones returned by the Google API.
+
+    Timestamps come in the formats Google uses: UTC with milliseconds for 'updated',
+    local time with offset or UTC for 'dateTime' and plain dates for all day entries.
+    """
+    rng = random.Random(seed)
+    semester_start = datetime.datetime(2021, 3, 15, 8, 15)
+    corpus = []
+    for i in range(size):
+        start = semester_start + datetime.timedelta(days=rng.randrange(120), minutes=105 * rng.randrange(6))
+        raw_entry = fake_entry(f'entry{i}', f'BAC{i % 7 + 1}A-Kurs{i % 12}', start)
+        raw_entry['updated'] = (start - datetime.timedelta(days=rng.randrange(60), seconds=rng.randrange(86400))
+                                ).strftime('%Y-%m-%dT%H:%M:%S.') + f'{rng.randrange(1000):03d}Z'
+        kind = rng.random()
+        if kind < 0.1:
+            raw_entry['start'] = {'date': start.date().isoformat()}
+            raw_entry['end'] = {'date': (start.date() + datetime.timedelta(days=1)).isoformat()}
+        elif kind < 0.8:
+            raw_entry['start'] = {'dateTime': start.strftime('%Y-%m-%dT%H:%M:%S+01:00'), 'timeZone': 'Europe/Berlin'}
+            raw_entry['end'] = {'dateTime': (start + datetime.timedelta(minutes=90)).strftime('%Y-%m-%dT%H:%M:%S+01:00'),
+                                'timeZone': 'Europe/Berlin'}
+        corpus.append(raw_entry)
+    return corpus
+
+
+def timestamps(corpus: List[Dict]) -> List[str]:
+    result = []
+    for raw_entry in corpus:
+        result.append(raw_entry['updated'])
+        for key in ('start', 'end'):
+            result.append(raw_entry[key].get('dateTime') or raw_entry[key].get('date'))
+    return result
+
+
+def bench_parse_datetime(size: int = 1000, repeat: int = 5) -> List[str]:
+    """Compares the fast timestamp parser with dateutil on the timestamps of a corpus of entries"""
+    strings = timestamps(entry_corpus(size))
+    for string in strings:
+        assert parse_datetime(string) == dateutil.parser.parse(string), string
+
+    lines = []
+    for name, parse in (('dateutil.parser.parse', dateutil.parser.parse), ('parse_datetime', parse_datetime)):
+        seconds = min(timeit.repeat(lambda: [parse(string) for string in strings], number=1, repeat=repeat))
+        lines.append(f'{name:22}: {seconds * 1e6 / len(strings):7.2f} µs per timestamp ({len(strings)} timestamps)')
+    return lines
+
+
+def bench_reformat_timedelta(number: int = 100000) -> List[str]:
+    deltas = [datetime.timedelta(seconds=seconds) for seconds in range(-7200, 7200, 37)]
+    seconds = timeit.timeit(lambda: [reformat_timedelta(delta) for delta in deltas], number=number // len(deltas))
+    return [f'{"reformat_timedelta":22}: {seconds * 1e6 / (number // len(deltas) * len(deltas)):7.2f} µs per call']
+
+
+class FakeMessage:
+    _ids = itertools.count(1)
+
+    def __init__(self, channel):
+        # a snowflake of now, so the message can be bulk deleted
+        self.id = discord.utils.time_snowflake(datetime.datetime.utcnow()) + next(self._ids)
+        self.channel = channel
+
+    async def edit(self, embed=None) -> None:
+        self.channel.calls['edit'] += 1
+
+    async def delete(self) -> None:
+        self.channel.calls['delete'] += 1
+
+
+class FakeChannel:
+    _ids = itertools.count(1)
+
+    def __init__(self, calls: Dict[str, int]):
+        self.id = next(self._ids)
+        self.calls = calls
+
+    async def send(self, content=None, embed=None) -> FakeMessage:
+        self.calls['send'] += 1
+        return FakeMessage(self)
+
+    async def delete_messages(self, messages: List[FakeMessage]) -> None:
+        self.calls['bulk delete'] += 1
+
+    def get_partial_message(self, message_id: int) -> FakeMessage:
+        message = FakeMessage(self)
+        message.id = message_id
+        return message
+
+
+class FakeValue:
+    def __init__(self, group, key: str):
+        self.group = group
+        self.key = key
+
+    async def __call__(self):
+        return self.group.values.get(self.key, [])
+
+    async def set(self, value) -> None:
+        self.group.calls['config write'] += 1
+        self.group.values[self.key] = value
+
+
+class FakeGroup:
+    """Stands in for a group of the Red Config"""
+    def __init__(self, calls: Dict[str, int]):
+        self.calls = calls
+        self.values = {}
+
+    def __getattr__(self, key: str) -> FakeValue:
+        return FakeValue(self, key)
+
+
+class FakeCog:
+    """The parts of the EitCogs used by a GoogleCalendar"""
+    def __init__(self, channels: List[FakeChannel], calls: Dict[str, int]):
+        self.calls = calls
+        self.guild = SimpleNamespace(id=1)
+        group = FakeGroup(calls)
+        self.config = SimpleNamespace(custom=lambda *args: group)
+        self.bot = SimpleNamespace(get_channel=lambda channel_id: next(
+            (channel for channel in channels if channel.id == channel_id), None))
+
+    async def log(self, invoke, embed=None) -> None:
+        self.calls['log'] += 1
+
+
+def semester_service(calendars: int, events: int, seed: int = 0) -> FakeCalendarService:
+    """A FakeCalendarService with the events of one day spread over the calendars, some of them already running"""
+    rng = random.Random(seed)
+    service = FakeCalendarService(calendars=calendars, entries_per_calendar=0, latency=0)
+    now = datetime.datetime.utcnow().replace(second=0, microsecond=0)
+    for i in range(events):
+        calendar_index = i % calendars
+        start = now + datetime.timedelta(minutes=15 * rng.randrange(-4, 92))
+        service.update_entry(service.calendars[calendar_index]['id'],
+                             fake_entry(f'e{i}', service.calendars[calendar_index]['summary'], start,
+                                        remind_minutes=rng.choice((15, 30, 60))))
+    for changes in service.changes.values():
+        changes.clear()
+    return service
+
+
+class Stages:
+    def __init__(self, calls: Dict[str, int], trace_allocations: bool):
+        self.calls = calls
+        self.trace_allocations = trace_allocations
+        self.lines = []
+
+    async def run(self, name: str, coroutine):
+        calls = dict(self.calls)
+        if self.trace_allocations:
+            tracemalloc.start()
+        start = time.perf_counter()
+        result = await coroutine
+        seconds = time.perf_counter() - start
+        allocated = ''
+        if self.trace_allocations:
+            allocated = f'{tracemalloc.get_traced_memory()[1] / 1024:9.0f} KiB peak'
+            tracemalloc.stop()
+        counts = ', '.join(f'{key} {self.calls[key] - calls.get(key, 0)}' for key in sorted(self.calls)
+                           if self.calls[key] != calls.get(key, 0))
+        self.lines.append(f'  {name:28}: {seconds * 1000:9.1f} ms {allocated}  {counts}')
+        return result
+
+
+async def bench_refresh(calendars: int, events: int, trace_allocations: bool = True) -> List[str]:
+    """Replays a day of a semester through the whole refresh pipeline and reports every stage"""
+    calls = dict.fromkeys(('send', 'edit', 'delete', 'bulk delete', 'config write', 'log'), 0)
+    stages = Stages(calls, trace_allocations)
+    service = semester_service(calendars, events)
+    channels = [FakeChannel(calls) for _ in range(7)]
+    channel_mapping = {calendar_info['summary'].split('-')[0]: channels[i % len(channels)]
+                       for i, calendar_info in enumerate(service.calendars)}
+
+    manager = CalendarManager(None, service=service, refresh_interval=60)
+    manager.refresh.cancel()
+    async with manager.sync_lock:
+        # the first sync of the calendar waits until the stages below are done
+        calendar = GoogleCalendar(manager, FakeCog(channels, calls), channel_mapping)
+        calendar.scheduler.cancel()
+        calendar.edit_queue.rate = 10 ** 9
+
+        async def run_api():
+            return await manager.run_api(manager.fetcher.fetch)
+
+        async def apply_fetch(synced):
+            manager.apply_fetch(synced)
+
+        async def upcoming_entries():
+            return manager.upcoming_entries(manager.refresh.seconds + 300)
+
+        async def due_updates():
+            # what the scheduler does once all deadlines are due
+            now = datetime.datetime.now(manager.timezone)
+            for reminder in list(calendar.reminders):
+                deadline = reminder.next_update(now)
+                if deadline and deadline <= now:
+                    await reminder.update()
+            await calendar.flush_reminders()
+            await drain(calendar)
+
+        synced = await stages.run('fetch (full)', run_api())
+        await stages.run('CalendarEntry construction', apply_fetch(synced))
+        entries = await stages.run('upcoming entries', upcoming_entries())
+        await stages.run('reconcile (first run)', calendar.reconcile(entries))
+        await stages.run('due reminder updates', due_updates())
+        await stages.run('due reminder updates again', due_updates())
+    # let the queued first sync pass
+    async with manager.sync_lock:
+        pass
+
+    rng = random.Random(1)
+    for calendar_info in rng.sample(service.calendars, max(1, calendars // 10)):
+        calendar_id = calendar_info['id']
+        for entry_id in rng.sample(list(service.entries[calendar_id]), min(3, len(service.entries[calendar_id]))):
+            raw_entry = dict(service.entries[calendar_id][entry_id], location='R0.000')
+            service.update_entry(calendar_id, raw_entry)
+
+    async def sync():
+        await manager.sync()
+        await due_updates()
+
+    await stages.run('sync (10% calendars changed)', sync())
+    await stages.run('sync (nothing changed)', sync())
+    service.expire_sync_tokens()
+    await stages.run('sync (sync tokens expired)', sync())
+    await stages.run('stop', manager.stop())
+
+    reminders = sum(len(calendar_entries) for calendar_entries in manager.entries.values())
+    return [f'{calendars} calendars, {events} events ({reminders} left in memory):'] + stages.lines
+
+
+async def drain(calendar: GoogleCalendar) -> None:
+    """Waits until the edit queue of the calendar is empty"""
+    while any(channel_queue.task for channel_queue in calendar.edit_queue.channels.values()):
+        await asyncio.sleep(0)
+
+
+def parse_scenario(scenario: str) -> Tuple[int, int]:
+    calendars, events = scenario.lower().split('x')
+    return int(calendars), int(events)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Offline benchmarks of the calendar pipeline')
+    parser.add_argument('--scenarios', nargs='+', type=parse_scenario, default=SCENARIOS,
+                        metavar='CALENDARSxEVENTS', help='semesters to replay, e.g. 10x100 500x10000')
+    parser.add_argument('--no-allocations', action='store_true', help='don\'t trace allocations (faster)')
+    args = parser.parse_args()
+
+    print('\n'.join(bench_parse_datetime() + bench_reformat_timedelta()))
+    for calendars, events in args.scenarios:
+        print('\n'.join(asyncio.run(bench_refresh(calendars, events, not args.no_allocations))))
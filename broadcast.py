@@ -0,0 +1,189 @@
+import asyncio
+import time
+from typing import Dict, Iterable, List, Optional
+
+import discord
+
+from .onboarding import AWAITING_GROUP, AWAITING_NAME
+from .setup import embed_semester_start, setup_start
+from .utils import codeblock
+
+
+# states of a member within a broadcast
+PENDING = 'pending'
+SENT = 'sent'
+FAILED = 'failed'
+COMPLETED = 'completed'
+
+# seconds between two progress reports and saves of the member states
+REPORT_INTERVAL = 10
+
+# dialogs which can be broadcast: name -> (first message, onboarding step waiting for the answer to it)
+DIALOGS = {
+    'setup': (lambda eitcog: setup_start, AWAITING_NAME),
+    'semesterstart': (lambda eitcog: embed_semester_start(eitcog.semesters), AWAITING_GROUP)
+}
+
+
+class Broadcast:
+    def __init__(self, eitcog, per_minute: int = 60, concurrency: int = 5):
+        """Runs a dialog with many members, e.g. the semester start dialog with every student.
+
+        Every member is only contacted once, no matter how many of the selected roles they have. The first
+        messages of the dialogs are sent by `concurrency` workers and at most `per_minute` per minute, the answers
+        are handled by the onboarding. The state of every member is saved in the config, so an interrupted
+        broadcast can be resumed without contacting anyone twice.
+
+        :param eitcog: the EITCogs Object
+        :param per_minute: first messages sent per minute at most
+        :param concurrency: first messages sent at once at most
+        """
+        self.eitcog = eitcog
+        self.interval = 60 / per_minute
+        self.concurrency = concurrency
+        self.state = eitcog.config.custom('Broadcast', str(eitcog.guild.id))
+
+        self.command: Optional[str] = None
+        # member id -> state
+        self.members: Dict[int, str] = {}
+        self.task = None
+        self._next_send = 0.0
+        # False until the saved broadcast was loaded or a new one started
+        self._loaded = False
+
+    @property
+    def running(self) -> bool:
+        return self.task is not None and not self.task.done()
+
+    def counts(self) -> Dict[str, int]:
+        counts = {PENDING: 0, SENT: 0, FAILED: 0, COMPLETED: 0}
+        for state in self.members.values():
+            counts[state] += 1
+        return counts
+
+    def progress(self) -> str:
+        counts = self.counts()
+        reached = counts[SENT] + counts[COMPLETED]
+        return (f'Broadcast {self.command}: {reached + counts[FAILED]}/{len(self.members)} bearbeitet\n'
+                f'Erreicht: {reached}, davon abgeschlossen: {counts[COMPLETED]}\n'
+                f'Fehlgeschlagen: {counts[FAILED]}, ausstehend: {counts[PENDING]}')
+
+    async def start(self, command: str, members: Iterable[discord.Member], channel: discord.TextChannel) -> None:
+        """Starts a new broadcast of the dialog `command` to the members, the progress is reported in channel"""
+        self.command = command
+        self.members = {member.id: PENDING for member in members if not member.bot}
+        self._loaded = True
+        await self.save()
+        await self.state.command.set(command)
+        self.task = asyncio.create_task(self._run(channel))
+
+    async def resume(self, channel: discord.TextChannel) -> bool:
+        """Continues the saved broadcast with the members which were not contacted yet
+
+        :return: False if there is no saved broadcast
+        """
+        await self.load()
+        if self.command not in DIALOGS:
+            return False
+        self.task = asyncio.create_task(self._run(channel))
+        return True
+
+    async def completed(self, member_id: int) -> None:
+        """Marks a member who finished the onboarding started by the broadcast"""
+        if not self._loaded:
+            # the first completion after a restart
+            await self.load()
+        if self.members.get(member_id) == SENT:
+            self.members[member_id] = COMPLETED
+            # while sending the states are saved with every report, otherwise only this state is written
+            if not self.running:
+                await self.state.members.set_raw(str(member_id), value=COMPLETED)
+
+    async def stop(self) -> None:
+        """Stops sending, dialogs which already started continue"""
+        if self.running:
+            self.task.cancel()
+            try:
+                await self.task
+            except asyncio.CancelledError:
+                pass
+        await self.save()
+
+    def cancel(self) -> None:
+        """Stops sending without waiting, e.g. when the cog is unloaded"""
+        if self.task:
+            self.task.cancel()
+
+    async def load(self) -> None:
+        self.command = await self.state.command()
+        self.members = {int(member_id): state for member_id, state in (await self.state.members()).items()}
+        self._loaded = True
+
+    async def save(self) -> None:
+        await self.state.members.set({str(member_id): state for member_id, state in self.members.items()})
+
+    async def _run(self, channel: discord.TextChannel) -> None:
+        queue = asyncio.Queue()
+        for member_id, state in self.members.items():
+            if state == PENDING:
+                queue.put_nowait(member_id)
+
+        report = await channel.send(codeblock(self.progress()))
+        workers = [asyncio.create_task(self._work(queue)) for _ in range(self.concurrency)]
+        try:
+            while not all(worker.done() for worker in workers):
+                await asyncio.wait(workers, timeout=REPORT_INTERVAL)
+                await self.save()
+                await self._report(report)
+        finally:
+            for worker in workers:
+                worker.cancel()
+            await self.save()
+        await channel.send(f'Broadcast {self.command} beendet!\n{codeblock(self.progress())}')
+
+    async def _work(self, queue: asyncio.Queue) -> None:
+        first_message, step = DIALOGS[self.command]
+        while not queue.empty():
+            member_id = queue.get_nowait()
+            member = self.eitcog.guild.get_member(member_id)
+            if member is None:
+                self.members[member_id] = FAILED
+                continue
+
+            await self._wait_for_slot()
+            try:
+                await member.send(embed=first_message(self.eitcog))
+            except discord.HTTPException as error:
+                if error.status == 429:
+                    # discord.py already retried, try this member again after a pause
+                    queue.put_nowait(member_id)
+                    await asyncio.sleep(self.interval * self.concurrency)
+                else:
+                    self.members[member_id] = FAILED
+                continue
+
+            self.members[member_id] = SENT
+            await self.eitcog.onboarding.begin(member_id, step)
+
+    async def _wait_for_slot(self) -> None:
+        # every send reserves the next free slot, so the workers together keep the rate
+        now = time.monotonic()
+        slot = max(now, self._next_send)
+        self._next_send = slot + self.interval
+        if slot > now:
+            await asyncio.sleep(slot - now)
+
+    async def _report(self, report: discord.Message) -> None:
+        try:
+            await report.edit(content=codeblock(self.progress()))
+        except discord.HTTPException:
+            pass
+
+
+def recipients(roles: Iterable[discord.Role]) -> List[discord.Member]:
+    """The members having any of the roles, every member only once"""
+    members = {}
+    for role in roles:
+        for member in role.members:
+            members.setdefault(member.id, member)
+    return list(members.values())
@@ -1,140 +1,391 @@
+from __future__ import annotations
 import asyncio
+import collections
 import datetime
+import functools
+import math
 import re
-from typing import Dict, List, Any
+from typing import Dict, Iterable, List, Tuple, Any
 
-from googleapiclient.discovery import build
 import dateutil.parser
 import html2text as html2text
 import pytz
 from discord.ext import tasks
 
+from .asyncfetcher import AsyncCalendarFetcher
+from .editqueue import EditQueue
+from .fetcher import CalendarFetcher
+from .metrics import Metrics, MetricsServer, loop_lag
+from .push import CalendarPush
+from .refreshpolicy import RefreshPolicy
+from .scheduler import ReminderScheduler
+from .servicepool import ServicePool
 from .utils import *
 
 
-active_calendar = None
+PROF_REGEXP = re.compile(r'(?<=\[).+?(?=\])')
+_UNSET = object()
 
+# channels cleaned up at once when a calendar stops
+CLEANUP_CONCURRENCY = 5
 
-class GoogleCalendar:
-    def __init__(self, eitcog, credentials: Any, channel_mapping: Any,
-                 fallback_channel: discord.TextChannel = None,
-                 refresh_interval: int = 60, timezone: str = 'Europe/Berlin'):
-        global active_calendar
-        if active_calendar:
-            return
 
-        self.eitcog = eitcog
-        self.timezone = pytz.timezone(timezone)
-        self.service = build('calendar', 'v3', credentials=credentials)
-        self.channel_mapping = channel_mapping
-        self.fallback_channel = fallback_channel
+class CalendarManager:
+    def __init__(self, credentials: Any, refresh_interval: int = 60, timezone: str = 'Europe/Berlin',
+                 batch_requests: bool = True, push_address: str = None, push_port: int = 8080,
+                 fallback_interval: int = 900, horizon: int = 24 * 60 * 60, client: str = 'googleapiclient',
+                 adaptive: bool = True, max_interval: int = 900, lead_time: int = 600, service: Any = None,
+                 metrics_port: int = None, fetch_threads: int = 4):
+        """Fetches the calendars once for all GoogleCalendar instances, e.g. one per guild.
 
-        self.reminders = []
-        self.active_reminders = {}
+        Every subscribed calendar is synced once per refresh, no matter how many calendars use it.
+        The refresh loop ticks every refresh_interval seconds, the RefreshPolicy decides whether a tick fetches.
+        Entries are kept in memory for the next `horizon` seconds, which should exceed the earliest reminder.
+        With client='aiohttp' the API is accessed from the event loop instead of googleapiclient in a thread.
+        A prebuilt googleapiclient service (or a FakeCalendarService) can be passed as service, otherwise every thread
+        builds its own from a cached discovery document. Without batch requests up to fetch_threads calendars
+        are fetched concurrently.
+        With a metrics_port the metrics are served in the Prometheus text format on http://<host>:<port>/metrics.
+        """
+        self.timezone = pytz.timezone(timezone)
+        self.metrics = Metrics()
+        if client == 'aiohttp':
+            self.fetcher = AsyncCalendarFetcher(credentials, horizon=horizon)
+        else:
+            pool = ServicePool(credentials, fetch_threads) if service is None else None
+            self.fetcher = CalendarFetcher(service, batch_requests, horizon=horizon, pool=pool)
+        self.calendars: List[GoogleCalendar] = []
+        self.metrics.register('api_round_trips', lambda: self.fetcher.round_trips)
+
+        # calendar id -> {entry id -> CalendarEntry}, kept up to date by the incremental sync
+        self.entries = {}
+        self.entry_cache = EntryCache()
+        # the fetcher (and its httplib2 connection) must only be used by one thread at a time
+        self.api_lock = asyncio.Lock()
+        self.sync_lock = asyncio.Lock()
+        self.policy = RefreshPolicy(refresh_interval, max_interval, lead_time, adaptive)
         self.refresh = tasks.loop(seconds=refresh_interval)(self.refresh)
         self.refresh.start()
 
-        self.update_reminders = tasks.loop(seconds=60)(self.update_reminders)
-        self.update_reminders.start()
+        # optionally get notified about changes instead of relying on polling only
+        if push_address:
+            self.push = CalendarPush(self, push_address, port=push_port, fallback_interval=fallback_interval)
+            asyncio.create_task(self.push.start())
+        else:
+            self.push = None
+
+        if metrics_port:
+            self.metrics_server = MetricsServer(self.metrics, port=metrics_port)
+            asyncio.create_task(self.metrics_server.start())
+        else:
+            self.metrics_server = None
 
-        active_calendar = self
+    def add(self, calendar: GoogleCalendar) -> None:
+        self.calendars.append(calendar)
+        # don't wait for the next refresh
+        asyncio.create_task(self.sync())
+
+    async def remove(self, calendar: GoogleCalendar) -> None:
+        """Stops the calendar and deletes its reminder messages"""
+        self.calendars.remove(calendar)
+        await calendar.stop()
 
     async def refresh(self) -> None:
-        global active_calendar
-        active_calendar = self
+        self.metrics.observe('lag_refresh', loop_lag(self.refresh))
+        if self.policy.due(datetime.datetime.now(self.timezone)):
+            # an exception would end the loop for good, the next tick tries again
+            try:
+                await self.sync()
+            except Exception as error:
+                self.metrics.count('sync_errors')
+                print(f'EITBOT: Could not sync the calendars: {error}')
+
+    async def run_api(self, func, *args) -> Any:
+        """Runs a fetcher method, blocking methods run in the executor"""
+        if asyncio.iscoroutinefunction(func):
+            return await func(*args)
+        async with self.api_lock:
+            return await asyncio.get_running_loop().run_in_executor(None, func, *args)
+
+    async def sync(self, calendar_ids: Iterable[str] = None) -> None:
+        """Syncs the calendars (all if calendar_ids is None) and updates the reminders of every GoogleCalendar"""
+        async with self.sync_lock:
+            with self.metrics.time('fetch'):
+                synced = await self.run_api(self.fetcher.fetch, calendar_ids, False)
+            with self.metrics.time('parse'):
+                self.apply_fetch(synced, calendar_ids)
+            # only continue from the new sync tokens once their changes are applied
+            self.fetcher.commit()
+
+            now = datetime.datetime.now(self.timezone)
+            self.policy.update(min((entry.reminder_start for calendar_entries in self.entries.values()
+                                    for entry in calendar_entries.values()), default=None), now)
+
+            # every reminder which could fire before the next fetch is needed, the scheduler takes care of the timing
+            max_seconds_until_remind = self.policy.interval + self.refresh.seconds + 300
+            entries = self.upcoming_entries(max_seconds_until_remind)
+
+            with self.metrics.time('reconcile'):
+                for calendar in list(self.calendars):
+                    await calendar.reconcile(entries)
+
+    async def stop(self) -> None:
+        """Stops all calendars and deletes their reminder messages"""
+        self.refresh.cancel()
+        if self.metrics_server:
+            await self.metrics_server.stop()
+        # deleting the messages needs no api, so no notification starts a sync meanwhile
+        await self._close_api()
+        await asyncio.gather(*(self.remove(calendar) for calendar in list(self.calendars)))
 
-        # Fetch the next 5 entries per calendar
-        loop = asyncio.get_running_loop()
-        raw_entries = await loop.run_in_executor(None, self.fetch_entries)
+    def cancel(self) -> None:
+        """Stops all tasks but keeps the reminder messages, they are picked up again by the next calendars.
 
-        entries = [CalendarEntry(raw_entry, self.timezone) for raw_entry in raw_entries]
+        The notification channels are closed, otherwise they would keep posting to the stopped receiver for days
+        while the next manager opens its own.
+        """
+        self.refresh.cancel()
+        if self.push:
+            self.push.renew.cancel()
+        if self.metrics_server:
+            asyncio.create_task(self.metrics_server.stop())
+        for calendar in self.calendars:
+            calendar.cancel()
+        asyncio.create_task(self._close_api())
+
+    async def _close_api(self) -> None:
+        """Closes the notification channels before the fetcher they are closed with"""
+        if self.push:
+            await self.push.stop()
+        if isinstance(self.fetcher, AsyncCalendarFetcher):
+            await self.fetcher.close()
+        elif self.fetcher.pool:
+            self.fetcher.pool.shutdown()
+
+    def apply_fetch(self, synced: List[Tuple[Dict, List[Dict], bool]], calendar_ids: Iterable[str] = None) -> None:
+        """ Applies the result of a fetch to the in-memory entries and drops finished entries
 
-        # Check all current reminders for updates
-        for reminder in self.reminders:
-            for entry in entries:
-                if reminder.id == entry.id:
-                    if entry.updated != reminder.updated:
-                        await reminder.update_reminder(entry)
-                    entries.remove(entry)
-                    break
+        Parameters
+        ----------
+        synced: The result of fetcher.fetch(calendar_ids)
+        calendar_ids: The synchronized calendars, the entries of the other calendars are kept as they are
+        """
+
+        synced_ids = set()
+        for calendar_info, raw_entries, full_sync in synced:
+            synced_ids.add(calendar_info['id'])
+            self._apply_changes(calendar_info, raw_entries, full_sync)
+
+        # forget calendars which are no longer subscribed
+        if calendar_ids is None:
+            for calendar_id in set(self.entries) - synced_ids:
+                self.entries.pop(calendar_id)
+
+        now = datetime.datetime.now(self.timezone)
+        for calendar_entries in self.entries.values():
+            for entry_id, entry in list(calendar_entries.items()):
+                if (entry.event_end or entry.event_start) <= now:
+                    calendar_entries.pop(entry_id)
+
+    def upcoming_entries(self, max_seconds_until_remind: int = 300) -> Dict[str, List[CalendarEntry]]:
+        """Returns the in-memory entries whose reminder fires within max_seconds_until_remind, keyed by calendar id"""
+        now = datetime.datetime.now(self.timezone)
+        return {calendar_id: [entry for entry in calendar_entries.values()
+                              if (entry.reminder_start - now).total_seconds() <= max_seconds_until_remind]
+                for calendar_id, calendar_entries in self.entries.items()}
+
+    def _apply_changes(self, calendar_info: Dict, raw_entries: List[Dict], full_sync: bool) -> None:
+        """Applies the changed raw entries of a calendar to the in-memory entries"""
+        if full_sync:
+            self.entries[calendar_info['id']] = {}
+        calendar_entries = self.entries.setdefault(calendar_info['id'], {})
+        horizon_end = self.fetcher.horizon_end(calendar_info['id'])
+
+        for raw_entry in raw_entries:
+            if raw_entry.get('status') == 'cancelled':
+                calendar_entries.pop(raw_entry['id'], None)
+                continue
+            if 'backgroundColor' in calendar_info:
+                raw_entry['calendarColorId'] = calendar_info['backgroundColor']
+            entry = self.entry_cache.get(raw_entry, self.timezone)
+            # changes beyond the horizon are fetched again once the horizon reaches them
+            if horizon_end and entry.event_start >= horizon_end:
+                calendar_entries.pop(entry.id, None)
             else:
-                await reminder.delete_message()
-                self.reminders.remove(reminder)
+                calendar_entries[entry.id] = entry
+
+
+class GoogleCalendar:
+    def __init__(self, manager: CalendarManager, eitcog, channel_mapping: Any,
+                 fallback_channel: discord.TextChannel = None, calendar_ids: Iterable[str] = None):
+        """Posts the reminders of the entries fetched by a CalendarManager to the channels of one guild
+
+        :param manager: the CalendarManager which fetches the entries
+        :param eitcog: the EITCogs object of the guild
+        :param channel_mapping: group name -> channel the reminders of this group are posted in
+        :param fallback_channel: channel for reminders of unknown groups
+        :param calendar_ids: only post reminders of these calendars, all calendars if None
+        """
+        self.manager = manager
+        self.eitcog = eitcog
+        self.timezone = manager.timezone
+        self.channel_mapping = channel_mapping
+        self.fallback_channel = fallback_channel
+        self.calendar_ids = set(calendar_ids) if calendar_ids is not None else None
+
+        self.reminders = ReminderStore()
+        self.active_reminders = {}
+
+        # sent reminder messages are persisted, so they are edited again instead of orphaned after a restart
+        self.state = eitcog.config.custom('Kalender', str(eitcog.guild.id))
+        self.restored = False
+        # set when a message was sent or deleted, the state is saved once per reconcile or scheduler batch
+        self.state_dirty = False
+
+        self.metrics = manager.metrics
+        self.scheduler = ReminderScheduler(self.reminders, self.timezone, self.metrics,
+                                           after_batch=self.flush_reminders)
+        self.scheduler.start()
+        self.edit_queue = EditQueue(metrics=self.metrics)
+
+        manager.add(self)
+
+    async def reconcile(self, entries: Dict[str, List[CalendarEntry]]) -> None:
+        """Updates the reminders to match the entries fetched by the manager"""
+        entries = [entry for calendar_id, calendar_entries in entries.items()
+                   if self.calendar_ids is None or calendar_id in self.calendar_ids
+                   for entry in calendar_entries]
+
+        # entry id -> message of the last run, only restored once after the first sync
+        restored = {}
+        if not self.restored:
+            restored = await self.load_reminders()
+            self.restored = True
+            await self.state.running.set(True)
+
+        added, updated, removed = self.reminders.diff(entries)
+
+        for reminder in removed:
+            self.scheduler.unschedule(reminder.id)
+            await reminder.delete_message()
+            self.reminders.pop(reminder.id)
+
+        for reminder, entry in updated:
+            await reminder.update_reminder(entry)
+            self.reminders.add(reminder)
+            self.scheduler.schedule(reminder)
 
         # Got new events
-        for entry in entries:
+        for entry in added:
             try:
                 group_name, course_name = entry.calendar_name.split('-')
-                if group_name in self.channel_mapping:
-                    channel = self.channel_mapping[group_name]
-                elif self.fallback_channel:
-                    channel = self.fallback_channel
-                else:
-                    await self.eitcog.log(
-                        f'EITBOT: Could not find an appropriate channel for calendar entry "{entry.summary}"')
-                    return
-                self.reminders.append(Reminder(self, entry, channel))
             except ValueError:
-                pass
+                continue
+            if group_name in self.channel_mapping:
+                channel = self.channel_mapping[group_name]
+            elif self.fallback_channel:
+                channel = self.fallback_channel
+            else:
+                await self.eitcog.log(
+                    f'EITBOT: Could not find an appropriate channel for calendar entry "{entry.summary}"')
+                continue
+            reminder = Reminder(self, entry, channel)
+            self.reminders.add(reminder)
+
+            state = restored.get(entry.id)
+            if state and state['channel'] == channel.id:
+                reminder.restore_message(state['message'])
+                restored.pop(entry.id)
+                # the entry could have changed while the bot was offline
+                self.scheduler.schedule(reminder, datetime.datetime.now(self.timezone))
+            else:
+                self.scheduler.schedule(reminder)
+
+        # delete messages of the last run whose entry is gone
+        if restored:
+            for state in restored.values():
+                channel = self.eitcog.bot.get_channel(state['channel'])
+                if channel:
+                    try:
+                        await channel.get_partial_message(state['message']).delete()
+                    except discord.NotFound:
+                        pass
+            self.state_dirty = True
+
+        await self.flush_reminders()
+
+    async def load_reminders(self) -> Dict[str, Dict]:
+        """Returns the persisted reminder messages keyed by entry id"""
+        return {state['id']: state for state in await self.state.reminder()}
+
+    async def flush_reminders(self) -> None:
+        """Saves the reminders if messages were sent or deleted since the last save"""
+        if self.state_dirty:
+            await self.save_reminders()
+
+    async def save_reminders(self) -> None:
+        """Persists entry id, updated timestamp, channel id and message id of every sent reminder message"""
+        self.state_dirty = False
+        await self.state.reminder.set([{'id': reminder.id,
+                                        'updated': reminder.updated.isoformat(),
+                                        'channel': reminder.channel.id,
+                                        'message': reminder.message.id}
+                                       for reminder in self.reminders if reminder.message])
 
     def __del__(self):
         print('Kalender wurde Garbage collected')
 
     async def stop(self):
-        global active_calendar
-        self.update_reminders.cancel()
-        self.refresh.cancel()
-        active_calendar = None
-
-        for reminder in self.reminders:
-            await reminder.delete_message()
-
-    async def update_reminders(self) -> None:
-        global active_calendar
-        active_calendar = self
+        """Deletes all reminder messages, channel by channel with bulk deletes, and forgets the reminders"""
+        self.scheduler.cancel()
+        self.edit_queue.cancel()
 
+        messages = collections.defaultdict(list)
         for reminder in self.reminders:
-            await reminder.update()
+            if reminder.message:
+                messages[reminder.channel].append(reminder.message)
+                reminder.message = None
+        limit = asyncio.Semaphore(CLEANUP_CONCURRENCY)
 
-    def fetch_entries(self, limit: int = 5, max_seconds_until_remind: int = 300) -> List:
-        # TODO: warum nur einträge mit remindern in 5 minuten oder weniger?
-        """ Fetches upcoming calendar entries
+        async def cleanup(channel, channel_messages):
+            async with limit:
+                with self.metrics.time('delete'):
+                    self.metrics.count('discord_deletes', await delete_messages(channel, channel_messages))
 
-        Parameters
-        ----------
-        limit:  The maximum amount of calendar entries fetched per calendar
-        max_seconds_until_remind:
-        Returns
-        -------
-        A flattened list of calendar entries
-        """
-
-        entries = []
-        for calendar_info, entry in self._fetch_calendar(limit):
-            time_until_remind = parse_remind_time(entry, self.timezone) - datetime.datetime.now(self.timezone)
-            if time_until_remind.total_seconds() <= max_seconds_until_remind:
-                if 'backgroundColor' in entry:
-                    entry['calendarColorId'] = calendar_info['backgroundColor']
-                entries.append(entry)
-        return entries
-
-    def _fetch_calendar(self, limit):
-        now = datetime.datetime.utcnow().isoformat() + 'Z'  # 'Z' indicates UTC time
-        calendar_result = self.service.calendarList().list().execute()
-        for calendar_info in calendar_result['items']:
-            calendar = self.service.events().list(calendarId=calendar_info['id'], timeMin=now, maxResults=limit,
-                                                  singleEvents=True, orderBy='startTime').execute()
-            for entry in calendar['items']:
-                yield calendar_info, entry
+        try:
+            results = await asyncio.gather(*(cleanup(channel, channel_messages)
+                                             for channel, channel_messages in messages.items()),
+                                           return_exceptions=True)
+            for error in results:
+                if error:
+                    print(f'EITBOT: Could not delete the reminder messages: {error}')
+        finally:
+            # messages which could not be deleted are forgotten as well, the calendar is stopped for good
+            self.reminders.clear()
+            self.active_reminders.clear()
+            await self.state.reminder.set([])
+            await self.state.running.set(False)
+
+    def cancel(self) -> None:
+        """Stops all tasks but keeps the reminder messages, they are picked up again by the next calendar"""
+        self.scheduler.cancel()
+        self.edit_queue.cancel()
+        asyncio.create_task(self.flush_reminders())
 
 
 class CalendarEntry:
+    __slots__ = ('id', 'updated', 'version', 'calendar_name', 'summary', 'event_start', 'event_end',
+                 'reminder_times', 'reminder_start', 'location', 'colour', '_raw_description', '_description', '_url',
+                 '_embed_template')
+
     def __init__(self, raw_entry: Dict, timezone: pytz.timezone):
 
-        self.updated = dateutil.parser.parse(raw_entry['updated']).astimezone(timezone)
+        self.updated = parse_datetime(raw_entry['updated']).astimezone(timezone)
 
         # mandatory
         self.id = raw_entry['id']
+        # identifies this version of the entry, same as its key in the EntryCache
+        self.version = (self.id, raw_entry['updated'], raw_entry.get('calendarColorId'))
         self.calendar_name = raw_entry["organizer"]["displayName"]
         self.summary = raw_entry["summary"]
         self.event_start = parse_time(raw_entry['start'], timezone)
@@ -142,45 +393,52 @@ class CalendarEntry:
         # optional
         if 'end' in raw_entry:
             self.event_end = parse_time(raw_entry['end'], timezone)
-            self.event_duration = self.event_end - self.event_start
         else:
             self.event_end = None
-            self.event_duration = None
-
-        self.reminder_start = parse_remind_time(raw_entry, timezone)
-
-        if 'description' in raw_entry:
-            self.description = html2text.html2text(raw_entry['description'])
-        else:
-            self.description = ''
 
-        if 'location' in raw_entry:
-            self.location = raw_entry['location']
-        else:
-            self.location = None
-
-        if 'calendarColorId' in raw_entry:
-            self.colour = discord.Colour(int(raw_entry['calendarColorId'].lstrip('#'), 16))
-        else:
-            self.colour = discord.Colour(0xFFFFFF)
-        prof_regexp = re.compile('(?<=\[).+?(?=\])')
-        try:
-            prof_name = prof_regexp.search(self.summary).group(0).lower(). \
-                replace('ä', 'ae').replace('ö', 'oe').replace('ü', 'ue').replace('ß', 'ss')
-            if prof_name in embed_links.keys():
-                self.url = embed_links[prof_name]
+        self.reminder_times = parse_remind_times(raw_entry, timezone, self.event_start)
+        self.reminder_start = self.reminder_times[0]
+        self.location = raw_entry.get('location')
+        self.colour = parse_colour(raw_entry.get('calendarColorId', '#FFFFFF'))
+
+        # only needed for the embed, computed on first access
+        self._raw_description = raw_entry.get('description')
+        self._description = None
+        self._url = _UNSET
+        self._embed_template = None
+
+    @property
+    def event_duration(self) -> datetime.timedelta:
+        if self.event_end:
+            return self.event_end - self.event_start
+
+    @property
+    def description(self) -> str:
+        if self._description is None:
+            self._description = html2text.html2text(self._raw_description) if self._raw_description else ''
+        return self._description
+
+    @property
+    def url(self) -> str:
+        """The thumbnail url of the professor in square brackets in the summary, None if there is none"""
+        if self._url is _UNSET:
+            match = PROF_REGEXP.search(self.summary)
+            if match:
+                prof_name = match.group(0).lower(). \
+                    replace('ä', 'ae').replace('ö', 'oe').replace('ü', 'ue').replace('ß', 'ss')
+                if prof_name in embed_links.keys():
+                    self._url = embed_links[prof_name]
+                else:
+                    self._url = f"https://w3-mediapool.hm.edu/mediapool/media/fk04/fk04_lokal/professoren_4/" \
+                                f"{prof_name}/{prof_name}_ContactBild.jpg"
             else:
-                self.url = f"https://w3-mediapool.hm.edu/mediapool/media/fk04/fk04_lokal/professoren_4/" \
-                           f"{prof_name}/{prof_name}_ContactBild.jpg"
-        except Exception as e:
-            print(f'{e}: Could not load calendarimage!')
+                self._url = None
+        return self._url
 
     def generate_embed(self) -> discord.Embed:
         embed = discord.Embed(description=self.description, colour=self.colour)
-        try:
+        if self.url:
             embed.set_thumbnail(url=self.url)
-        except Exception as e:
-            print(e)
 
         if self.location:
             embed.add_field(name="Ort / URL", value=self.location, inline=False)
@@ -194,6 +452,92 @@ class CalendarEntry:
 
         return embed
 
+    @property
+    def embed_template(self) -> Dict:
+        """The embed without title as a dict, it is only rendered once per entry version"""
+        if self._embed_template is None:
+            self._embed_template = self.generate_embed().to_dict()
+        return self._embed_template
+
+
+class EntryCache:
+    def __init__(self, maxsize: int = 4096):
+        """Least recently used cache of parsed calendar entries.
+
+        Entries are keyed by id, updated timestamp and calendar colour, so an entry is only parsed again
+        if it changed, e.g. when a calendar has to be synced completely again.
+        """
+        self.maxsize = maxsize
+        self._entries = collections.OrderedDict()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def get(self, raw_entry: Dict, timezone: pytz.timezone) -> CalendarEntry:
+        key = (raw_entry['id'], raw_entry['updated'], raw_entry.get('calendarColorId'))
+        entry = self._entries.get(key)
+        if entry is None:
+            entry = self._entries[key] = CalendarEntry(raw_entry, timezone)
+            if len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+        else:
+            self._entries.move_to_end(key)
+        return entry
+
+
+class ReminderStore:
+    def __init__(self):
+        """Reminders indexed by the id of their calendar entry, iteration is ordered by reminder start"""
+        self._reminders = {}
+        self._ordered = None
+
+    def __len__(self) -> int:
+        return len(self._reminders)
+
+    def __contains__(self, entry_id: str) -> bool:
+        return entry_id in self._reminders
+
+    def __iter__(self):
+        if self._ordered is None:
+            self._ordered = sorted(self._reminders.values(), key=lambda reminder: reminder.entry.reminder_start)
+        return iter(self._ordered)
+
+    def get(self, entry_id: str) -> Reminder:
+        return self._reminders.get(entry_id)
+
+    def add(self, reminder: Reminder) -> None:
+        """Adds a reminder or replaces the reminder with the same id"""
+        self._reminders[reminder.id] = reminder
+        self._ordered = None
+
+    def pop(self, entry_id: str) -> Reminder:
+        self._ordered = None
+        return self._reminders.pop(entry_id, None)
+
+    def clear(self) -> None:
+        self._reminders.clear()
+        self._ordered = None
+
+    def diff(self, entries: List[CalendarEntry]):
+        """Compares fetched entries with the stored reminders in linear time
+
+        Returns
+        -------
+        The entries without a reminder, (reminder, entry) pairs of entries which were updated
+        and the reminders whose entry was not fetched anymore
+        """
+        fetched = {entry.id: entry for entry in entries}
+        added = [entry for entry_id, entry in fetched.items() if entry_id not in self._reminders]
+        updated = []
+        removed = []
+        for entry_id, reminder in self._reminders.items():
+            entry = fetched.get(entry_id)
+            if entry is None:
+                removed.append(reminder)
+            elif entry.updated != reminder.updated:
+                updated.append((reminder, entry))
+        return added, updated, removed
+
 
 class Reminder:
     def __init__(self, calendar: GoogleCalendar, entry: CalendarEntry, channel: discord.TextChannel):
@@ -206,17 +550,25 @@ class Reminder:
         self.updated = self.entry.updated
 
         self.message = None
-        self.embed = self.entry.generate_embed()
+        self.sent_at = None
+        # only the title changes while the reminder is shown, the rest of the embed comes from the entry
+        self.title = None
+        # render key of the embed as it was last sent to discord
+        self.sent_render = None
 
     async def update(self) -> None:
         now = datetime.datetime.now(self.calendar.timezone)
 
-        if self.entry.event_end <= now:
+        if (self.entry.event_end or self.entry.event_start) <= now:
             await self.delete_message()
 
         elif self.entry.reminder_start <= now:
             self.set_embed_title()
-            if self.message:
+            if self.message and self.sent_at < self.last_reminder_time(now):
+                # every further reminder of the entry posts the message again
+                await self.delete_message()
+                await self.send_message()
+            elif self.message:
                 await self.update_message()
             else:
                 await self.send_message()
@@ -224,29 +576,82 @@ class Reminder:
         elif self.message:
             await self.delete_message()
 
+    @property
+    def embed(self) -> discord.Embed:
+        return discord.Embed.from_dict(dict(self.entry.embed_template, title=self.title))
+
+    @property
+    def render_key(self) -> tuple:
+        """Compact form of the embed, two embeds with the same render key are equal"""
+        return self.entry.version, self.title
+
+    def next_update(self, now: datetime.datetime) -> datetime.datetime:
+        """Returns when update() has to be called next or None if the reminder is done"""
+        event_end = self.entry.event_end or self.entry.event_start
+        if event_end <= now:
+            return now if self.message else None
+
+        if self.entry.reminder_start <= now:
+            if not self.message:
+                return now
+            # the title only changes when the minutes until/since the event start change
+            next_minute = self.entry.event_start + datetime.timedelta(
+                minutes=math.ceil((now - self.entry.event_start).total_seconds() / 60))
+            if next_minute <= now:
+                next_minute += datetime.timedelta(minutes=1)
+            next_reminder = next((time for time in self.entry.reminder_times if time > now), event_end)
+            return min(next_minute, next_reminder, event_end)
+
+        return now if self.message else self.entry.reminder_start
+
+    def last_reminder_time(self, now: datetime.datetime) -> datetime.datetime:
+        """Returns the latest reminder time of the entry which is not in the future"""
+        return max(time for time in self.entry.reminder_times if time <= now)
+
     async def send_message(self):
-        self.message = await self.channel.send(embed=self.embed)
+        metrics = self.calendar.metrics
+        with metrics.time('render'):
+            embed = self.embed
+        with metrics.time('send'):
+            self.message = await self.channel.send(embed=embed)
+        metrics.count('discord_sends')
+        if self.calendar.reminders.get(self.id) is not self:
+            # the reminder was removed while its message was sent, nothing else would delete it
+            await self.delete_message()
+            return
+        self.sent_at = datetime.datetime.now(self.calendar.timezone)
+        self.sent_render = self.render_key
 
         self.calendar.active_reminders.update({self.message.id: (self.message, self.entry)})
+        self.calendar.state_dirty = True
+
+    def restore_message(self, message_id: int) -> None:
+        """Continues with a message sent before a restart"""
+        self.message = self.channel.get_partial_message(message_id)
+        self.sent_at = datetime.datetime.now(self.calendar.timezone)
+        self.calendar.active_reminders.update({self.message.id: (self.message, self.entry)})
 
     async def delete_message(self) -> None:
         if not self.message:
             return
+        self.calendar.edit_queue.discard(self)
+        metrics = self.calendar.metrics
         try:
-            await self.message.delete()
-            self.calendar.active_reminders.pop(self.message.id)
+            with metrics.time('delete'):
+                await self.message.delete()
+            metrics.count('discord_deletes')
         except discord.NotFound:
-            pass
+            metrics.count('discord_not_found')
+        self.calendar.active_reminders.pop(self.message.id, None)
+        self.message = None
+        self.calendar.state_dirty = True
 
     async def update_message(self) -> None:
-        try:
-            await self.message.edit(embed=self.embed)
-        except discord.NotFound:
-            await self.calendar.eitcog.log(f'Konnte die Nachricht nicht updaten', self.embed)
+        self.calendar.edit_queue.submit(self)
 
     async def update_reminder(self, entry: CalendarEntry) -> None:
         self.entry = entry
-        self.embed = entry.generate_embed()
+        self.updated = entry.updated
         await self.update()
 
     def set_embed_title(self) -> None:
@@ -255,28 +660,48 @@ class Reminder:
             preposition = 'in'
         else:
             preposition = 'seit'
-        self.embed.title = f'**{self.entry.calendar_name}**:  ' \
-                           f'{self.entry.summary} {preposition} {reformat_timedelta(timedelta=time_until_event)}!'
+        self.title = f'**{self.entry.calendar_name}**:  ' \
+                     f'{self.entry.summary} {preposition} {reformat_timedelta(timedelta=time_until_event)}!'
 
 
-def parse_remind_time(raw_entry: Dict, timezone: datetime.tzinfo):
-    """Returns the time when the entries reminder should fire as a dateime object."""
-    if 'reminders' in raw_entry and 'overrides' in raw_entry['reminders']:
-        remind_minutes = raw_entry['reminders']['overrides'][0]['minutes']
-    else:
-        remind_minutes = 30
-    return parse_time(raw_entry['start'], timezone) - datetime.timedelta(minutes=remind_minutes)
+@functools.lru_cache(maxsize=None)
+def parse_colour(hex_colour: str) -> discord.Colour:
+    """Converts a hex colour string like '#2fb923' to a discord colour, there are only a few distinct calendar colours"""
+    return discord.Colour(int(hex_colour.lstrip('#'), 16))
+
+
+def parse_remind_times(raw_entry: Dict, timezone: datetime.tzinfo, event_start: datetime.datetime = None):
+    """Returns the times when the entries reminders should fire as a sorted tuple of datetime objects.
+
+    Pass the already parsed start of the entry as event_start to avoid parsing it again.
+    """
+    # only popup reminders are shown on Discord, email reminders usually fire much earlier
+    remind_minutes = {override['minutes'] for override in raw_entry.get('reminders', {}).get('overrides', [])
+                      if override.get('method') == 'popup'} or {30}
+    if event_start is None:
+        event_start = parse_time(raw_entry['start'], timezone)
+    return tuple(event_start - datetime.timedelta(minutes=minutes) for minutes in sorted(remind_minutes, reverse=True))
 
 
 def parse_time(time: Dict, timezone: datetime.tzinfo):
     if 'dateTime' in time:
-        return dateutil.parser.parse(time['dateTime']).astimezone(timezone)
+        return parse_datetime(time['dateTime']).astimezone(timezone)
     elif 'date' in time:
-        return dateutil.parser.parse(time['date']).astimezone(timezone)
+        return parse_datetime(time['date']).astimezone(timezone)
     else:
         print("EITBOT: No date or dateTime key in entry dict recieved from Google Calendar API. Ignoring entry.")
 
 
+def parse_datetime(timestamp: str) -> datetime.datetime:
+    """Parses the RFC 3339 timestamps and dates of the Google API, dateutil is only used if the fast path fails"""
+    if timestamp[-1:] in ('Z', 'z'):
+        timestamp = timestamp[:-1] + '+00:00'
+    try:
+        return datetime.datetime.fromisoformat(timestamp)
+    except ValueError:
+        return dateutil.parser.parse(timestamp)
+
+
 def reformat_timedelta(timedelta) -> str:
     try:
         obj = abs(timedelta.total_seconds())
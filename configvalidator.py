@@ -1,4 +1,4 @@
-from schema import Schema, SchemaError
+from schema import Optional, Or, Schema, SchemaError
 
 
 schema = Schema({
@@ -10,6 +10,32 @@ schema = Schema({
 
     'semesters': {
         int: list
+    },
+
+    # keyword arguments of the CalendarManager
+    Optional('calendar'): {
+        Optional('refresh_interval'): int,
+        Optional('push_address'): str,
+        Optional('push_port'): int,
+        Optional('fallback_interval'): int,
+        Optional('horizon'): int,
+        Optional('client'): Or('googleapiclient', 'aiohttp'),
+        Optional('batch_requests'): bool,
+        Optional('fetch_threads'): int,
+        Optional('adaptive'): bool,
+        Optional('max_interval'): int,
+        Optional('lead_time'): int,
+        Optional('metrics_port'): int
+    },
+
+    Optional('dialogs'): {
+        Optional('timeout'): int
+    },
+
+    # keyword arguments of the Broadcast
+    Optional('broadcast'): {
+        Optional('per_minute'): int,
+        Optional('concurrency'): int
     }
 })
 
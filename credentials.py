@@ -0,0 +1,99 @@
+import asyncio
+import datetime
+import os
+import pickle
+from typing import Any
+
+from google.auth.transport.requests import Request
+from google_auth_oauthlib.flow import InstalledAppFlow
+
+
+SCOPES = ['https://www.googleapis.com/auth/calendar.readonly']
+
+# delay until a failed refresh is retried
+RETRY_DELAY = 60
+
+
+class CredentialManager:
+    def __init__(self, token_path: str = './data/token.pickle', secrets_path: str = './data/credentials.json',
+                 refresh_margin: int = 300):
+        """Loads the Google credentials once and keeps their access token valid.
+
+        All file and network I/O runs in the executor, the token is refreshed by a background task
+        `refresh_margin` seconds before it expires, so API requests never have to wait for a refresh.
+
+        :param token_path: pickle file the credentials are cached in
+        :param secrets_path: client secrets used to log in if there are no (valid) credentials
+        :param refresh_margin: seconds before expiry the access token is refreshed
+        """
+        self.token_path = token_path
+        self.secrets_path = secrets_path
+        self.refresh_margin = refresh_margin
+
+        self.credentials = None
+        self._lock = asyncio.Lock()
+        self._task = None
+
+    async def load(self) -> Any:
+        """Returns the credentials, they are only loaded on the first call"""
+        async with self._lock:
+            if self.credentials is None:
+                self.credentials = await asyncio.get_running_loop().run_in_executor(None, self._load)
+            if self._task is None:
+                self._task = asyncio.create_task(self._run())
+        return self.credentials
+
+    def stop(self) -> None:
+        if self._task:
+            self._task.cancel()
+            self._task = None
+
+    async def refresh(self) -> None:
+        """Refreshes the access token and saves the credentials"""
+        await asyncio.get_running_loop().run_in_executor(None, self._refresh)
+
+    def seconds_until_refresh(self) -> float:
+        """Returns the seconds until the token should be refreshed or None if it doesn't expire"""
+        if self.credentials.expiry is None:
+            return None
+        # google.auth keeps the expiry as naive utc
+        expires_in = (self.credentials.expiry - datetime.datetime.utcnow()).total_seconds()
+        return max(expires_in - self.refresh_margin, 0)
+
+    async def _run(self) -> None:
+        while True:
+            delay = self.seconds_until_refresh()
+            if delay is None:
+                return
+            await asyncio.sleep(delay)
+            try:
+                await self.refresh()
+            except Exception as error:
+                print(f'EITBOT: Could not refresh the Google credentials: {error}')
+                await asyncio.sleep(RETRY_DELAY)
+
+    def _load(self) -> Any:
+        credentials = None
+        if os.path.exists(self.token_path):
+            with open(self.token_path, 'rb') as token:
+                credentials = pickle.load(token)
+
+        # If there are no (valid) credentials available, let the user log in.
+        if not credentials or not credentials.valid:
+            if credentials and credentials.expired and credentials.refresh_token:
+                credentials.refresh(Request())
+            else:
+                flow = InstalledAppFlow.from_client_secrets_file(self.secrets_path, SCOPES)
+                credentials = flow.run_local_server(port=0)
+            self._save(credentials)
+
+        return credentials
+
+    def _refresh(self) -> None:
+        self.credentials.refresh(Request())
+        self._save(self.credentials)
+
+    def _save(self, credentials: Any) -> None:
+        # Save the credentials for the next run
+        with open(self.token_path, 'wb') as token:
+            pickle.dump(credentials, token)
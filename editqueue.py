@@ -0,0 +1,108 @@
+import asyncio
+import collections
+import time
+from typing import Dict
+
+import discord
+
+from .metrics import Metrics
+
+
+class ChannelQueue:
+    def __init__(self):
+        # message id -> reminder, a reminder is only queued once no matter how often it was updated
+        self.pending: Dict[int, object] = {}
+        self.edit_times = collections.deque()
+        self.task = None
+
+
+class EditQueue:
+    def __init__(self, rate: int = 5, per: float = 5.0, metrics: Metrics = None):
+        """Edits reminder messages in the background, at most `rate` edits per `per` seconds and channel.
+
+        An edit is skipped if the render key of the embed didn't change since it was last sent, multiple updates
+        of a reminder which wait in the queue are combined into one edit of its latest embed.
+
+        :param rate: edits per channel allowed within `per` seconds, Discord allows 5 edits per 5 seconds
+        :param per: length of the rate limit window in seconds
+        :param metrics: counts the edits, skipped edits, 429 and 404 responses
+        """
+        self.rate = rate
+        self.per = per
+        self.channels: Dict[int, ChannelQueue] = {}
+        self.metrics = metrics or Metrics()
+
+    def submit(self, reminder) -> None:
+        """Queues an edit of the reminders message with its current embed"""
+        if reminder.render_key == reminder.sent_render:
+            self.metrics.count('discord_edits_skipped')
+            return
+
+        channel_queue = self.channels.setdefault(reminder.channel.id, ChannelQueue())
+        channel_queue.pending[reminder.message.id] = reminder
+        if channel_queue.task is None:
+            channel_queue.task = asyncio.create_task(self._work(channel_queue))
+
+    def discard(self, reminder) -> None:
+        """Drops a queued edit, e.g. because the message is about to be deleted"""
+        channel_queue = self.channels.get(reminder.channel.id)
+        if channel_queue and reminder.message:
+            channel_queue.pending.pop(reminder.message.id, None)
+
+    def cancel(self) -> None:
+        for channel_queue in self.channels.values():
+            if channel_queue.task:
+                channel_queue.task.cancel()
+        self.channels.clear()
+
+    async def _work(self, channel_queue: ChannelQueue) -> None:
+        try:
+            while channel_queue.pending:
+                await self._wait_for_slot(channel_queue)
+                if not channel_queue.pending:
+                    break
+
+                message_id = next(iter(channel_queue.pending))
+                reminder = channel_queue.pending.pop(message_id)
+                # a failing edit must not end the worker, the other reminders of the channel still wait for theirs
+                try:
+                    await self._edit(channel_queue, message_id, reminder)
+                except Exception as error:
+                    print(f'EITBOT: Could not edit the reminder for "{reminder.entry.summary}": {error}')
+        finally:
+            # the next submit starts a new worker
+            channel_queue.task = None
+
+    async def _edit(self, channel_queue: ChannelQueue, message_id: int, reminder) -> None:
+        render_key = reminder.render_key
+        if reminder.message is None or reminder.message.id != message_id or render_key == reminder.sent_render:
+            self.metrics.count('discord_edits_skipped')
+            return
+
+        channel_queue.edit_times.append(time.monotonic())
+        try:
+            with self.metrics.time('render'):
+                embed = reminder.embed
+            with self.metrics.time('edit'):
+                await reminder.message.edit(embed=embed)
+        except discord.NotFound:
+            self.metrics.count('discord_not_found')
+            await reminder.calendar.eitcog.log('Konnte die Nachricht nicht updaten', reminder.embed)
+        except discord.HTTPException as error:
+            if error.status != 429:
+                raise
+            # discord.py already retried, slow this channel down and try again later
+            self.metrics.count('discord_rate_limited')
+            channel_queue.pending.setdefault(message_id, reminder)
+            await asyncio.sleep(self.per)
+        else:
+            reminder.sent_render = render_key
+            self.metrics.count('discord_edits')
+
+    async def _wait_for_slot(self, channel_queue: ChannelQueue) -> None:
+        edit_times = channel_queue.edit_times
+        while edit_times and time.monotonic() - edit_times[0] >= self.per:
+            edit_times.popleft()
+        if len(edit_times) >= self.rate:
+            await asyncio.sleep(self.per - (time.monotonic() - edit_times[0]))
+            edit_times.popleft()
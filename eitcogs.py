@@ -1,47 +1,23 @@
 from __future__ import annotations
 import asyncio
-import os
-import pickle
 import typing
 import discord
 import yaml
-from google.auth.transport.requests import Request
-from google_auth_oauthlib.flow import InstalledAppFlow
 
 from redbot.core import commands, Config
 from redbot.core.bot import Red
-from typing import List, Any
+from typing import List
 
 
-from .userinput import UserInput, is_bool_expression, stop_keys
-from .calendar import GoogleCalendar
-from .setup import setup_dialog, semester_start_dialog, embed_group_select, group_selection
+from .userinput import DialogClosed, MessageDispatcher, UserInput, is_bool_expression, stop_keys
+from .calendar import CalendarManager, GoogleCalendar
+from .credentials import CredentialManager
+from .broadcast import DIALOGS, Broadcast, recipients
+from .onboarding import Onboarding
 from .utils import get_member, toggle_role, codeblock, get_obj_by_name
 from .configvalidator import validate
 
 RequestType = typing.Literal["discord_deleted_user", "owner", "user", "user_strict"]
-SCOPES = ['https://www.googleapis.com/auth/calendar.readonly']
-
-
-def get_google_creds(creds: Any = None) -> Any:
-    if os.path.exists('./data/token.pickle'):
-        with open('./data/token.pickle', 'rb') as token:
-            creds = pickle.load(token)
-
-        # If there are no (valid) credentials available, let the user log in.
-    if not creds or not creds.valid:
-        if creds and creds.expired and creds.refresh_token:
-            creds.refresh(Request())
-
-        else:
-            flow = InstalledAppFlow.from_client_secrets_file('./data/credentials.json', SCOPES)
-            creds = flow.run_local_server(port=0)
-
-        # Save the credentials for the next run
-        with open('./data/token.pickle', 'wb') as token:
-            pickle.dump(creds, token)
-
-    return creds
 
 
 class EitCogs(commands.Cog):
@@ -62,15 +38,52 @@ class EitCogs(commands.Cog):
         self.semesters = []
         self.groups = []
         self.calendar = None
+        self.calendar_manager = None
+        self.calendar_config = {}
+        self.broadcaster = None
+        self.broadcast_config = {}
+        self.credentials = CredentialManager()
+
+        # one listener for all dialogs instead of one per dialog
+        self.dispatcher = MessageDispatcher(bot)
+        # the setup dialogs continue with the next DM, also after a restart
+        self.onboarding = Onboarding(self)
+        self.onboarding.done_callbacks.append(self.onboarding_done)
+        self.dispatcher.handlers.append(self.onboarding)
 
         self.bot.add_listener(self.on_member_join)
+        self.bot.add_listener(self.dispatcher.on_message, 'on_message')
+        self.bot.add_listener(self.dispatcher.prefixes.on_command_completion, 'on_command_completion')
 
         self.config.init_custom('Kalender', 1)
         self.config.register_custom('Kalender', **default_reminder)
+        self.config.init_custom('Broadcast', 1)
+        self.config.register_custom('Broadcast', command=None, members={})
+        self.config.init_custom('Onboarding', 1)
+        self.config.register_custom('Onboarding', step=None, asked=0, errors=0)
+
+        # the pending onboardings are restored as soon as the guild is known, not with the first command
+        self.init_task = asyncio.create_task(self.initialize())
 
     def __del__(self):
         print('EITCogs wurde garbage collected')
 
+    async def initialize(self) -> None:
+        await self.bot.wait_until_red_ready()
+        await self.cog_check(None)
+
+    def cog_unload(self):
+        self.init_task.cancel()
+        self.bot.remove_listener(self.dispatcher.on_message, 'on_message')
+        self.bot.remove_listener(self.dispatcher.prefixes.on_command_completion, 'on_command_completion')
+        self.dispatcher.cancel()
+        if self.broadcaster:
+            self.broadcaster.cancel()
+        # the reminder messages stay, the calendar of the reloaded cog continues with them
+        if self.calendar_manager:
+            self.calendar_manager.cancel()
+        self.credentials.stop()
+
     async def log(self, invoke, embed=None):
         await self.channels['botlog'].send(invoke, embed=embed)
 
@@ -85,7 +98,7 @@ class EitCogs(commands.Cog):
             await asyncio.wait_for(self.pending_check(member), 86400)  # Timeout after 1 day
         except asyncio.exceptions.TimeoutError:
             await self.log(f'{member.display_name} wasn\'t verified after one day! Stopped checking pending status!')
-        await setup_dialog(self, member)
+        await self.onboarding.setup(member)
 
     async def pending_check(self, member):
         while get_member(self.guild, member).pending:
@@ -110,6 +123,10 @@ class EitCogs(commands.Cog):
         except FileNotFoundError:
             await self.log('EITBOT: No configuration file found')
 
+        self.calendar_config = config.get('calendar', {})
+        self.broadcast_config = config.get('broadcast', {})
+        self.dispatcher.timeout = config.get('dialogs', {}).get('timeout', self.dispatcher.timeout)
+
         for guild in self.bot.guilds:
             if config['server'] == guild.id:
                 self.guild = guild
@@ -152,8 +169,16 @@ class EitCogs(commands.Cog):
 
             self.semesters.append(new_semester)
 
+        await self.onboarding.load()
+
     async def red_delete_data_for_user(self, *, requester: RequestType, user_id: int) -> None:
-        # TODO: Replace this with the proper end user data removal handling.
+        await self.onboarding.cancel(user_id)
+        # the broadcasts keep the state of every member they contacted
+        if self.broadcaster:
+            self.broadcaster.members.pop(user_id, None)
+        for guild_id, broadcast in (await self.config.custom('Broadcast').all()).items():
+            if str(user_id) in broadcast.get('members', {}):
+                await self.config.custom('Broadcast', guild_id).clear_raw('members', str(user_id))
         await super().red_delete_data_for_user(requester=requester, user_id=user_id)
 
     @commands.command()
@@ -166,21 +191,20 @@ class EitCogs(commands.Cog):
     async def setup(self, context: commands.context) -> None:
         """Startet den Setup-Dialog"""
         member = get_member(self.guild, context.author)
-        await setup_dialog(self, member)
+        await self.onboarding.setup(member)
 
     @commands.command(aliases=['change group'])
     async def changegroup(self, context):
         """Startet einen Dialog zum Ändern der Gruppe"""
         member = get_member(self.guild, context.author)
-        await context.author.send(embed=embed_group_select(member.display_name, self.semesters))
-        await group_selection(self, member)
+        await self.onboarding.change_group(member)
 
     @commands.admin()
     @commands.command()
     async def semester_start(self, context: commands.context) -> None:
         """Startet den Semesterstart Dialog --dev"""
         member = get_member(self.guild, context.author)
-        await semester_start_dialog(self, member)
+        await self.onboarding.semester_start(member)
 
     @commands.command()
     async def admin(self, context: commands.context) -> None:
@@ -207,7 +231,12 @@ class EitCogs(commands.Cog):
         await context.channel.send('Die Umfrage wird jetzt vorbereitet, gib deine Fragen im Dialog an!')
         poll = []
         while True:
-            message = await UserInput.userinput(self, context.author, context.author.dm_channel, only_content=True)
+            try:
+                message = await UserInput.userinput(self, context.author, context.author.dm_channel,
+                                                    only_content=True)
+            except DialogClosed:
+                await context.channel.send('Die Umfrage wurde abgebrochen!')
+                return
             if stop_keys(message):
                 output = ''
                 for entry in poll:
@@ -226,22 +255,53 @@ class EitCogs(commands.Cog):
                         channel: typing.Optional[discord.TextChannel] = None,
                         command=None):
         """Erlaubt das Ausführen der Dialoge an alle Servermitglieder mit der ausgewählten Rolle --dev"""
+        if command not in DIALOGS:
+            await context.send(f'Verfügbare Dialoge: {", ".join(DIALOGS)}')
+            return
+        broadcaster = self.get_broadcaster()
+        if broadcaster.running:
+            await context.send('Es läuft bereits ein Broadcast!')
+            return
+
+        receiver = recipients(role for role in roles if role in context.guild.roles)
+        await broadcaster.start(command, receiver, channel or context.channel)
+
+    @commands.admin()
+    @commands.command()
+    async def broadcast_resume(self, context: commands.context, channel: discord.TextChannel = None):
+        """Setzt den letzten Broadcast bei den noch nicht angeschriebenen Mitgliedern fort --dev"""
+        broadcaster = self.get_broadcaster()
+        if broadcaster.running:
+            await context.send('Es läuft bereits ein Broadcast!')
+        elif not await broadcaster.resume(channel or context.channel):
+            await context.send('Es gibt keinen Broadcast zum Fortsetzen!')
+
+    @commands.admin()
+    @commands.command()
+    async def broadcast_stop(self, context: commands.context):
+        """Stoppt den laufenden Broadcast, bereits begonnene Dialoge laufen weiter --dev"""
+        if self.broadcaster is None or not self.broadcaster.running:
+            await context.send('Es läuft kein Broadcast!')
+            return
+        await self.broadcaster.stop()
+        await context.send(f'Broadcast gestoppt!\n{codeblock(self.broadcaster.progress())}')
 
-        available_commands = {'setup': setup_dialog,
-                              'semesterstart': semester_start_dialog}
+    @commands.admin()
+    @commands.command()
+    async def broadcast_status(self, context: commands.context):
+        """Zeigt den Fortschritt des letzten Broadcasts an --dev"""
+        if self.broadcaster is None or self.broadcaster.command is None:
+            await context.send('Es gab noch keinen Broadcast!')
+            return
+        await context.send(codeblock(self.broadcaster.progress()))
 
-        receiver = []
-        for role in roles:
-            if role in context.guild.roles:
-                for member in role.members:
-                    receiver.append(member)
+    async def onboarding_done(self, member_id: int) -> None:
+        await self.get_broadcaster().completed(member_id)
 
-        if command in available_commands:
-            for member in receiver:
-                try:
-                    asyncio.create_task(available_commands[command](self, member))
-                except (AttributeError, discord.HTTPException):
-                    print(f'Memberid: {member.id} - Kein DM-Channel - Vermutlich ein Bot')
+    def get_broadcaster(self) -> Broadcast:
+        if self.broadcaster is None:
+            self.broadcaster = Broadcast(self, **self.broadcast_config)
+        return self.broadcaster
 
     @commands.check(is_student)
     @commands.command()
@@ -270,26 +330,111 @@ class EitCogs(commands.Cog):
     async def start(self, ctx):
         """Startet eine Kalenderinstanz --dev"""
 
+        if self.calendar:
+            await ctx.send('Kalender ist bereits gestartet!')
+            return
+
+        if self.calendar_manager is None:
+            self.calendar_manager = CalendarManager(await self.credentials.load(), **self.calendar_config)
         channel_mapping = {group.name: group.semester.channel for group in self.groups}
-        self.calendar = GoogleCalendar(self, get_google_creds(), channel_mapping, fallback_channel=self.channels['kalender'])
+        self.calendar = GoogleCalendar(self.calendar_manager, self, channel_mapping,
+                                       fallback_channel=self.channels['kalender'])
         await ctx.send('Kalender gestartet!')
 
     @commands.admin()
     @commands.command()
     async def stop(self, ctx):
         """Stoppt den Kalender --dev"""
-        from .calendar import active_calendar
-        if active_calendar:
-            await active_calendar.stop()
+        if await self.stop_calendar():
             await ctx.send('Kalender gestoppt!')
         else:
             await ctx.send('Kalender ist nicht gestartet!')
 
+    async def stop_calendar(self) -> bool:
+        """Removes the calendar from its manager and stops the manager once it has no calendars left
+
+        :return: False if the calendar wasn't started
+        """
+        if not self.calendar:
+            return False
+        await self.calendar_manager.remove(self.calendar)
+        self.calendar = None
+        if not self.calendar_manager.calendars:
+            await self.calendar_manager.stop()
+            self.calendar_manager = None
+        return True
+
+    @commands.admin()
+    @commands.command()
+    async def reload_calendars(self, ctx):
+        """Lädt die Kalenderliste beim nächsten Refresh neu --dev"""
+        if self.calendar:
+            self.calendar_manager.fetcher.invalidate_calendars()
+            await ctx.send('Die Kalenderliste wird beim nächsten Refresh neu geladen!')
+        else:
+            await ctx.send('Kalender ist nicht gestartet!')
+
+    @commands.admin()
+    @commands.command()
+    async def refresh_policy(self, ctx):
+        """Zeigt an, wann und warum der Kalender das nächste Mal abgefragt wird --dev"""
+        if not self.calendar:
+            await ctx.send('Kalender ist nicht gestartet!')
+            return
+
+        policy = self.calendar_manager.policy
+        next_poll = policy.next_poll.strftime('%H:%M:%S') if policy.next_poll else 'beim nächsten Durchlauf'
+        next_reminder = policy.next_reminder.strftime('%d.%m. %H:%M') if policy.next_reminder else 'keine'
+        output = (f'Modus: {"adaptiv" if policy.adaptive else "fest"}\n'
+                  f'Intervall: {policy.interval}s ({policy.reason})\n'
+                  f'Nächste Abfrage: {next_poll}\n'
+                  f'Nächste Erinnerung: {next_reminder}\n'
+                  f'Grenzen: {policy.min_interval}s - {policy.max_interval}s, Vorlauf {policy.lead_time}s\n'
+                  f'Abfragen: {policy.polls}, übersprungen: {policy.skipped}')
+        await ctx.send(codeblock(output))
+
+    @commands.admin()
+    @commands.command()
+    async def calendar_metrics(self, ctx):
+        """Zeigt Laufzeiten und Zähler der Kalenderschleife an --dev"""
+        if not self.calendar:
+            await ctx.send('Kalender ist nicht gestartet!')
+            return
+        await ctx.send(codeblock('\n'.join(self.calendar_manager.metrics.summary())))
+
+    @commands.admin()
+    @commands.command()
+    async def dialogs(self, ctx, limit: int = 10):
+        """Zeigt die offenen Dialoge und wie lange sie schon auf eine Antwort warten --dev"""
+        waiting = self.dispatcher.waiting
+        closed = ', '.join(f'{reason}: {amount}' for reason, amount in sorted(self.dispatcher.closed.items()))
+        onboarding = self.onboarding.counts()
+        output = (f'Offene Dialoge: {len(waiting)}\n'
+                  f'Onboarding: {onboarding["name"]} warten auf den Namen, {onboarding["group"]} auf die Gruppe\n'
+                  f'Timeout: {self.dispatcher.timeout // 60} min\n'
+                  f'Beendet: {closed or "keine"}\n')
+        for userinput in self.dispatcher.oldest(limit):
+            channel = 'DM' if isinstance(userinput.channel, discord.DMChannel) else f'#{userinput.channel}'
+            output += f'\n{userinput.user.display_name} ({channel}): seit {int(userinput.age // 60)} min'
+        await ctx.send(codeblock(output))
+
+    @commands.admin()
+    @commands.command()
+    async def cancel_dialogs(self, ctx, member: discord.Member = None):
+        """Bricht die offenen Dialoge eines Mitglieds ab, ohne Angabe alle Dialoge --dev"""
+        amount = self.dispatcher.cancel(member.id if member else None)
+        if member is None:
+            amount += await self.onboarding.cancel_all()
+        elif await self.onboarding.cancel(member.id):
+            amount += 1
+        await ctx.send(f'{amount} Dialog(e) abgebrochen!')
+
     @commands.admin()
     @commands.command()
     async def clean_calender(self, ctx):
         """Stoppt den Kalender --dev"""
-        self.calendar = None
+        # only dropping the reference would leave the calendar running on the manager next to the one of `start`
+        await self.stop_calendar()
         await ctx.send('Kalender gestoppt!')
 
     # @commands.command()
@@ -0,0 +1,338 @@
+"""Offline stand-in for the Google Calendar API service, used to measure the calendar pipeline without network.
+
+Example (from the directory containing the cog package)::
+
+    python -m eitcogs.fakeservice
+"""
+import asyncio
+import datetime
+import time
+from typing import Dict, List
+
+import aiohttp
+import httplib2
+from aiohttp import web
+from googleapiclient.errors import HttpError
+
+from .asyncfetcher import AsyncCalendarFetcher
+from .fetcher import CalendarFetcher
+
+
+class FakeRequest:
+    def __init__(self, service, handler, **kwargs):
+        self.service = service
+        self.handler = handler
+        self.kwargs = kwargs
+        self.headers = {}
+
+    def execute(self) -> Dict:
+        self.service.round_trip()
+        return self.response()
+
+    def response(self) -> Dict:
+        self.service.requests += 1
+        return self.handler(headers=self.headers, **self.kwargs)
+
+
+class FakeBatchRequest:
+    def __init__(self, service, callback=None):
+        self.service = service
+        self.callback = callback
+        self.requests = []
+
+    def add(self, request: FakeRequest, callback=None, request_id: str = None) -> None:
+        self.requests.append((request, callback or self.callback, request_id or str(len(self.requests))))
+
+    def execute(self) -> None:
+        self.service.round_trip()
+        for request, callback, request_id in self.requests:
+            try:
+                response, exception = request.response(), None
+            except HttpError as error:
+                response, exception = None, error
+            if callback:
+                callback(request_id, response, exception)
+
+
+class FakeResource:
+    def __init__(self, service, **handlers):
+        self.service = service
+        self.handlers = handlers
+
+    def __getattr__(self, method: str):
+        if method not in self.handlers:
+            raise AttributeError(method)
+        return lambda **kwargs: FakeRequest(self.service, self.handlers[method], **kwargs)
+
+
+class FakeCalendarService:
+    def __init__(self, calendars: int = 30, entries_per_calendar: int = 5, latency: float = 0.05,
+                 page_size: int = 250):
+        """Mimics the parts of a calendar service used by the CalendarFetcher.
+
+        Every execute() of a request or batch sleeps for `latency` seconds to simulate one HTTP round trip.
+        Sync tokens are supported, see `update_entry`, `delete_entry` and `expire_sync_tokens`.
+        Notification channels opened with events().watch() receive real http requests from `notify`.
+
+        :param calendars: amount of subscribed calendars
+        :param entries_per_calendar: amount of upcoming entries per calendar
+        :param latency: seconds per round trip
+        :param page_size: maximum amount of entries per response page
+        """
+        self.latency = latency
+        self.page_size = page_size
+        self.round_trips = 0
+        self.requests = 0
+        self.notifications = 0
+
+        self.calendars = []
+        self.entries = {}
+        # calendar id -> ids of changed entries in order of their change, a sync token is an index into it
+        self.changes = {}
+        self.token_generation = 0
+        # channel id -> (calendar id, channel) of the open notification channels
+        self.watch_channels = {}
+
+        start = datetime.datetime.utcnow().replace(minute=0, second=0, microsecond=0) + datetime.timedelta(hours=1)
+        for i in range(calendars):
+            calendar_id = f'calendar{i}@group.calendar.google.com'
+            self.calendars.append({'id': calendar_id, 'summary': f'BAC{i}A-Kurs{i}', 'backgroundColor': '#2fb923'})
+            self.entries[calendar_id] = {}
+            self.changes[calendar_id] = []
+            for j in range(entries_per_calendar):
+                self.update_entry(calendar_id, fake_entry(f'c{i}e{j}', f'BAC{i}A-Kurs{i}',
+                                                          start + datetime.timedelta(hours=j)))
+            self.changes[calendar_id].clear()
+
+    def round_trip(self) -> None:
+        self.round_trips += 1
+        if self.latency:
+            time.sleep(self.latency)
+
+    def calendarList(self) -> FakeResource:
+        return FakeResource(self, list=self._list_calendars)
+
+    def events(self) -> FakeResource:
+        return FakeResource(self, list=self._list_events, watch=self._watch)
+
+    def channels(self) -> FakeResource:
+        return FakeResource(self, stop=self._stop_channel)
+
+    def new_batch_http_request(self, callback=None) -> FakeBatchRequest:
+        return FakeBatchRequest(self, callback)
+
+    def update_entry(self, calendar_id: str, raw_entry: Dict) -> None:
+        raw_entry['updated'] = datetime.datetime.utcnow().isoformat() + 'Z'
+        self.entries[calendar_id][raw_entry['id']] = raw_entry
+        self.changes[calendar_id].append(raw_entry['id'])
+
+    def delete_entry(self, calendar_id: str, entry_id: str) -> None:
+        self.entries[calendar_id][entry_id] = {'id': entry_id, 'status': 'cancelled'}
+        self.changes[calendar_id].append(entry_id)
+
+    def expire_sync_tokens(self) -> None:
+        """All sync tokens handed out so far are answered with 410 Gone"""
+        self.token_generation += 1
+
+    async def notify(self, calendar_id: str, state: str = 'exists') -> List[int]:
+        """Posts a change notification to every channel watching the calendar, like Google does
+
+        Returns
+        -------
+        The http status of every response
+        """
+        statuses = []
+        async with aiohttp.ClientSession() as session:
+            for channel_calendar_id, channel in list(self.watch_channels.values()):
+                if channel_calendar_id != calendar_id:
+                    continue
+                self.notifications += 1
+                headers = {'X-Goog-Channel-ID': channel['id'],
+                           'X-Goog-Channel-Token': channel['token'],
+                           'X-Goog-Resource-ID': channel['resourceId'],
+                           'X-Goog-Resource-State': state,
+                           'X-Goog-Message-Number': str(self.notifications)}
+                async with session.post(channel['address'], headers=headers) as response:
+                    statuses.append(response.status)
+        return statuses
+
+    def _watch(self, calendarId: str, body: Dict, **kwargs) -> Dict:
+        expiration = int((time.time() + int(body.get('params', {}).get('ttl', 604800))) * 1000)
+        channel = dict(body, resourceId=f'resource-{calendarId}', expiration=str(expiration))
+        self.watch_channels[channel['id']] = (calendarId, channel)
+        return {'kind': 'api#channel', 'id': channel['id'], 'resourceId': channel['resourceId'],
+                'expiration': channel['expiration']}
+
+    def _stop_channel(self, body: Dict, **kwargs) -> None:
+        self.watch_channels.pop(body['id'], None)
+
+    def _list_calendars(self, headers: Dict, **kwargs) -> Dict:
+        etag = f'"{hash(repr(self.calendars))}"'
+        if headers.get('If-None-Match') == etag:
+            raise HttpError(httplib2.Response({'status': 304}), b'', uri='calendarList')
+        return {'etag': etag, 'items': list(self.calendars)}
+
+    def _list_events(self, calendarId: str, syncToken: str = None, pageToken: str = None, **kwargs) -> Dict:
+        if syncToken:
+            generation, position = map(int, syncToken.split(':'))
+            if generation != self.token_generation:
+                raise HttpError(httplib2.Response({'status': 410}), b'', uri=calendarId)
+            entry_ids = list(dict.fromkeys(self.changes[calendarId][position:]))
+            items = [self.entries[calendarId][entry_id] for entry_id in entry_ids]
+        else:
+            items = [entry for entry in self.entries[calendarId].values() if entry.get('status') != 'cancelled'
+                     and in_window(entry, kwargs.get('timeMin'), kwargs.get('timeMax'))]
+
+        offset = int(pageToken or 0)
+        response = {'items': items[offset:offset + self.page_size]}
+        if offset + self.page_size < len(items):
+            response['nextPageToken'] = str(offset + self.page_size)
+        else:
+            response['nextSyncToken'] = f'{self.token_generation}:{len(self.changes[calendarId])}'
+        return response
+
+
+class FakeCredentials:
+    """Credentials for the FakeCalendarServer, the token expires after `lifetime` seconds"""
+    def __init__(self, lifetime: float = 3600):
+        self.lifetime = lifetime
+        self.refreshes = 0
+        self.token = None
+        self.expiry = 0
+
+    @property
+    def valid(self) -> bool:
+        return self.token is not None and time.time() < self.expiry
+
+    def refresh(self, request) -> None:
+        self.refreshes += 1
+        self.token = f'token{self.refreshes}'
+        self.expiry = time.time() + self.lifetime
+
+    def apply(self, headers: Dict) -> None:
+        headers['Authorization'] = f'Bearer {self.token}'
+
+
+class FakeCalendarServer:
+    def __init__(self, service: FakeCalendarService, host: str = '127.0.0.1', port: int = 0):
+        """Serves a FakeCalendarService over http with the REST interface of the Google Calendar API.
+
+        Used to test the AsyncCalendarFetcher, pass `url` as its base_url. Every request waits `service.latency`
+        seconds without blocking, so concurrent requests overlap like they do with the real API.
+        """
+        self.service = service
+        self.host = host
+        self.port = port
+        self._runner = None
+
+    @property
+    def url(self) -> str:
+        return f'http://{self.host}:{self.port}/calendar/v3'
+
+    async def start(self) -> None:
+        app = web.Application()
+        app.router.add_get('/calendar/v3/users/me/calendarList', self._handle)
+        app.router.add_get('/calendar/v3/calendars/{calendarId}/events', self._handle)
+        app.router.add_post('/calendar/v3/calendars/{calendarId}/events/watch', self._handle)
+        app.router.add_post('/calendar/v3/channels/stop', self._handle)
+        self._runner = web.AppRunner(app)
+        await self._runner.setup()
+        site = web.TCPSite(self._runner, self.host, self.port)
+        await site.start()
+        self.port = site._server.sockets[0].getsockname()[1]
+
+    async def stop(self) -> None:
+        if self._runner:
+            await self._runner.cleanup()
+            self._runner = None
+
+    async def _handle(self, request: web.Request) -> web.Response:
+        if not request.headers.get('Authorization', '').startswith('Bearer '):
+            return web.Response(status=401)
+
+        self.service.round_trips += 1
+        self.service.requests += 1
+        if self.service.latency:
+            await asyncio.sleep(self.service.latency)
+
+        path = request.path
+        kwargs = dict(request.query, **request.match_info)
+        try:
+            if path.endswith('/calendarList'):
+                result = self.service._list_calendars(headers=request.headers)
+            elif path.endswith('/events'):
+                result = self.service._list_events(**kwargs)
+            elif path.endswith('/watch'):
+                result = self.service._watch(body=await request.json(), **kwargs)
+            else:
+                result = self.service._stop_channel(body=await request.json())
+        except HttpError as error:
+            return web.Response(status=error.resp.status)
+        return web.json_response(result) if result is not None else web.Response(status=204)
+
+
+def in_window(raw_entry: Dict, time_min: str = None, time_max: str = None) -> bool:
+    """Checks if an entry overlaps the time window, like the timeMin and timeMax parameters of events().list()"""
+    def parse(timestamp):
+        return datetime.datetime.fromisoformat(timestamp.replace('Z', '+00:00'))
+    if time_min and parse(raw_entry['end']['dateTime']) <= parse(time_min):
+        return False
+    if time_max and parse(raw_entry['start']['dateTime']) >= parse(time_max):
+        return False
+    return True
+
+
+def fake_entry(entry_id: str, calendar_name: str, start: datetime.datetime,
+               duration: datetime.timedelta = datetime.timedelta(minutes=90), remind_minutes: int = 15) -> Dict:
+    """Builds a raw entry like the ones returned by events().list()"""
+    return {
+        'id': entry_id,
+        'status': 'confirmed',
+        'updated': datetime.datetime.utcnow().isoformat() + 'Z',
+        'summary': f'Vorlesung [Galek] {entry_id}',
+        'description': '<b>Vorlesung</b><br>Bitte pünktlich sein!',
+        'location': 'R1.046',
+        'organizer': {'displayName': calendar_name},
+        'start': {'dateTime': start.isoformat() + 'Z'},
+        'end': {'dateTime': (start + duration).isoformat() + 'Z'},
+        'reminders': {'useDefault': False, 'overrides': [{'method': 'popup', 'minutes': remind_minutes}]},
+    }
+
+
+def compare_fetch(calendars: int = 30, latency: float = 0.05) -> List[str]:
+    """Times a full and an incremental fetch of all calendars with and without batch requests"""
+    lines = []
+    for batch_requests in (False, True):
+        service = FakeCalendarService(calendars=calendars, latency=latency)
+        fetcher = CalendarFetcher(service, batch_requests=batch_requests)
+        for sync in ('full', 'incremental'):
+            round_trips = service.round_trips
+            start = time.perf_counter()
+            fetcher.fetch()
+            lines.append(f'batch_requests={batch_requests!s:5} {sync:11}: {time.perf_counter() - start:.3f}s, '
+                         f'{service.round_trips - round_trips} round trips')
+    return lines
+
+
+async def compare_async_fetch(calendars: int = 30, latency: float = 0.05) -> List[str]:
+    """Times a full and an incremental fetch of all calendars with the AsyncCalendarFetcher"""
+    service = FakeCalendarService(calendars=calendars, latency=latency)
+    server = FakeCalendarServer(service)
+    await server.start()
+    fetcher = AsyncCalendarFetcher(FakeCredentials(), base_url=server.url)
+    lines = []
+    try:
+        for sync in ('full', 'incremental'):
+            round_trips = service.round_trips
+            start = time.perf_counter()
+            await fetcher.fetch()
+            lines.append(f'aiohttp              {sync:11}: {time.perf_counter() - start:.3f}s, '
+                         f'{service.round_trips - round_trips} round trips')
+    finally:
+        await fetcher.close()
+        await server.stop()
+    return lines
+
+
+if __name__ == '__main__':
+    print('\n'.join(compare_fetch() + asyncio.run(compare_async_fetch())))
@@ -0,0 +1,269 @@
+import datetime
+import time
+import uuid
+from typing import Dict, Iterable, List, Tuple
+
+from googleapiclient.errors import HttpError
+
+from .servicepool import ServicePool
+
+
+# Google accepts up to 1000 calls per batch, but recommends to stay at 50 or below
+MAX_BATCH_SIZE = 50
+
+# metadata kept per subscribed calendar
+CALENDAR_FIELDS = ('id', 'summary', 'backgroundColor')
+
+# the horizon is extended in steps, so its edge is not requested on every fetch
+HORIZON_STEP = datetime.timedelta(hours=1)
+
+
+class CalendarFetcher:
+    def __init__(self, service, batch_requests: bool = True, calendar_list_ttl: int = 3600,
+                 horizon: int = 24 * 60 * 60, pool: ServicePool = None):
+        """Fetches calendar entries from the Google Calendar API.
+
+        Entries are synchronized incrementally, for every calendar the sync token of the last fetch is kept and
+        only the entries which changed since then are requested.
+        Only the entries within the next `horizon` seconds are fetched, when the horizon moves on only the
+        entries at its edge are requested.
+
+        :param service: a googleapiclient calendar service (or a stand-in with the same interface)
+        :param batch_requests: fetch all calendars with one batch request instead of one request per calendar
+        :param calendar_list_ttl: seconds until the cached calendar list is revalidated
+        :param horizon: seconds into the future entries are fetched for
+        :param pool: gives every thread its own service instead of sharing `service`, without batch requests the
+                     calendars are then fetched concurrently on its threads
+        """
+        self._service = service
+        self.pool = pool
+        self.batch_requests = batch_requests
+        self.sync_tokens = {}
+        self.round_trips = 0
+
+        self.horizon = datetime.timedelta(seconds=horizon)
+        # calendar id -> end of the time window the entries of the calendar were fetched for
+        self.horizon_ends = {}
+        # sync tokens and horizon ends of the last fetch, they replace the current ones with `commit`
+        self._staged_tokens = {}
+        self._staged_ends = {}
+
+        self.calendar_list_ttl = calendar_list_ttl
+        self.calendars = []
+        self.calendar_list_etag = None
+        self.calendar_list_expires = 0
+
+    def fetch(self, calendar_ids: Iterable[str] = None, commit: bool = True) -> List[Tuple[Dict, List[Dict], bool]]:
+        """Synchronizes all subscribed calendars
+
+        The new sync tokens only replace the old ones with `commit`, so if the fetch of one calendar fails or its
+        result is not applied, the changes of all calendars are fetched again the next time.
+
+        Parameters
+        ----------
+        calendar_ids: Only synchronize these calendars instead of all subscribed calendars
+        commit: Commit the new sync tokens right away, without it the caller has to call `commit` once it applied
+                the result
+        Returns
+        -------
+        A list of (calendar info, changed raw entries, full sync) tuples, one per subscribed calendar.
+        If full sync is True the raw entries contain all entries of the calendar within the horizon,
+        otherwise only the entries which changed since the last fetch and the entries at the edge of the horizon.
+        Changed entries can lie beyond the horizon, see `horizon_ends`.
+        """
+        self._discard_staged()
+        calendar_infos = self.list_calendars()
+        if calendar_ids is None:
+            calendar_ids = [calendar_info['id'] for calendar_info in calendar_infos]
+            # forget calendars which are no longer subscribed
+            for calendar_id in set(self.sync_tokens) - set(calendar_ids):
+                self.sync_tokens.pop(calendar_id)
+                self.horizon_ends.pop(calendar_id, None)
+        else:
+            calendar_infos = [calendar_info for calendar_info in calendar_infos if calendar_info['id'] in calendar_ids]
+            calendar_ids = [calendar_info['id'] for calendar_info in calendar_infos]
+
+        if self.batch_requests:
+            synced = self._sync_calendars_batched(calendar_ids)
+        elif self.pool and self.pool.max_workers > 1:
+            synced = dict(zip(calendar_ids, self.pool.executor.map(self._sync_calendar, calendar_ids)))
+        else:
+            synced = {calendar_id: self._sync_calendar(calendar_id) for calendar_id in calendar_ids}
+
+        if commit:
+            self.commit()
+        return [(calendar_info, *synced[calendar_info['id']]) for calendar_info in calendar_infos]
+
+    def commit(self) -> None:
+        """Continues the next fetch from the sync tokens and horizon ends of the last fetch"""
+        self.sync_tokens.update(self._staged_tokens)
+        self.horizon_ends.update(self._staged_ends)
+        self._discard_staged()
+
+    def horizon_end(self, calendar_id: str) -> datetime.datetime:
+        """End of the time window the entries of the calendar were fetched for, including an uncommitted fetch"""
+        return self._staged_ends.get(calendar_id, self.horizon_ends.get(calendar_id))
+
+    def _discard_staged(self) -> None:
+        self._staged_tokens = {}
+        self._staged_ends = {}
+
+    @property
+    def service(self):
+        """The service of the current thread"""
+        return self.pool.service() if self.pool else self._service
+
+    def list_calendars(self) -> List[Dict]:
+        """Returns the subscribed calendars.
+
+        The calendar list is cached for calendar_list_ttl seconds, afterwards it is revalidated with its ETag
+        and only downloaded again if it changed.
+        """
+        if time.monotonic() < self.calendar_list_expires:
+            return self.calendars
+
+        request = self.service.calendarList().list()
+        if self.calendar_list_etag:
+            request.headers['If-None-Match'] = self.calendar_list_etag
+        self.round_trips += 1
+        try:
+            result = request.execute()
+        except HttpError as error:
+            # 304 Not Modified: the cached calendar list is still valid
+            if error.resp.status != 304:
+                raise
+        else:
+            self.calendars = [{key: calendar_info[key] for key in CALENDAR_FIELDS if key in calendar_info}
+                              for calendar_info in result['items']]
+            self.calendar_list_etag = result.get('etag')
+
+        self.calendar_list_expires = time.monotonic() + self.calendar_list_ttl
+        return self.calendars
+
+    def invalidate_calendars(self) -> None:
+        """Forces a download of the calendar list on the next fetch"""
+        self.calendar_list_etag = None
+        self.calendar_list_expires = 0
+
+    def watch(self, calendar_id: str, address: str, token: str, ttl: int) -> Dict:
+        """Opens a channel which posts a notification to the address whenever entries of the calendar change"""
+        body = {'id': str(uuid.uuid4()), 'type': 'web_hook', 'address': address, 'token': token,
+                'params': {'ttl': str(ttl)}}
+        self.round_trips += 1
+        return self.service.events().watch(calendarId=calendar_id, body=body).execute()
+
+    def stop_channel(self, channel: Dict) -> None:
+        self.round_trips += 1
+        self.service.channels().stop(body={'id': channel['id'], 'resourceId': channel['resourceId']}).execute()
+
+    def _sync_calendar(self, calendar_id: str) -> Tuple[List[Dict], bool]:
+        """Returns the entries of a calendar which changed since the last sync and whether this was a full sync.
+
+        Without a sync token (first run or expired token) all entries within the horizon are fetched.
+        """
+        raw_entries = []
+        full_sync = False
+        for kind, params, window_end in self._jobs(calendar_id):
+            page_token = None
+            while True:
+                self.round_trips += 1
+                try:
+                    result = self._events_request(calendar_id, params, page_token).execute()
+                except HttpError as error:
+                    if kind != 'sync' or not self._sync_token_expired(calendar_id, error):
+                        raise
+                    return self._sync_calendar(calendar_id)
+
+                raw_entries.extend(result.get('items', []))
+                page_token = result.get('nextPageToken')
+                if not page_token:
+                    self._complete(calendar_id, kind, result, window_end)
+                    break
+            full_sync = full_sync or kind == 'full'
+        return raw_entries, full_sync
+
+    def _sync_calendars_batched(self, calendar_ids: List[str]) -> Dict[str, Tuple[List[Dict], bool]]:
+        """Same as _sync_calendar for multiple calendars, each page of all calendars is fetched in one round trip"""
+        raw_entries = {calendar_id: [] for calendar_id in calendar_ids}
+        full_sync = {calendar_id: False for calendar_id in calendar_ids}
+        errors = []
+
+        # request id -> (calendar id, kind, params, window end, page token) of the next requests
+        pending = {}
+        next_pending = {}
+
+        def add_jobs(calendar_id):
+            for kind, params, window_end in self._jobs(calendar_id):
+                next_pending[f'{kind}:{calendar_id}'] = (calendar_id, kind, params, window_end, None)
+                full_sync[calendar_id] = full_sync[calendar_id] or kind == 'full'
+
+        def callback(request_id, result, exception):
+            calendar_id, kind, params, window_end, _ = pending[request_id]
+            if exception is not None:
+                if kind == 'sync' and self._sync_token_expired(calendar_id, exception):
+                    raw_entries[calendar_id] = []
+                    next_pending.pop(f'edge:{calendar_id}', None)
+                    add_jobs(calendar_id)
+                else:
+                    errors.append(exception)
+                return
+
+            raw_entries[calendar_id].extend(result.get('items', []))
+            if result.get('nextPageToken'):
+                next_pending[request_id] = (calendar_id, kind, params, window_end, result['nextPageToken'])
+            else:
+                self._complete(calendar_id, kind, result, window_end)
+
+        for calendar_id in calendar_ids:
+            add_jobs(calendar_id)
+        pending, next_pending = next_pending, {}
+
+        while pending:
+            requests = list(pending.items())
+            for i in range(0, len(requests), MAX_BATCH_SIZE):
+                batch = self.service.new_batch_http_request(callback=callback)
+                for request_id, (calendar_id, _, params, _, page_token) in requests[i:i + MAX_BATCH_SIZE]:
+                    batch.add(self._events_request(calendar_id, params, page_token), request_id=request_id)
+                self.round_trips += 1
+                batch.execute()
+            if errors:
+                raise errors[0]
+            pending, next_pending = next_pending, {}
+
+        return {calendar_id: (raw_entries[calendar_id], full_sync[calendar_id]) for calendar_id in calendar_ids}
+
+    def _jobs(self, calendar_id: str) -> List[Tuple[str, Dict, datetime.datetime]]:
+        """Returns the (kind, query parameters, window end) of the requests needed to sync a calendar
+
+        'full' fetches all entries within the horizon, 'sync' the changes since the last sync
+        and 'edge' the entries between the old and the new end of the horizon.
+        """
+        now = datetime.datetime.now(datetime.timezone.utc)
+        horizon_end = now + self.horizon
+        sync_token = self.sync_tokens.get(calendar_id)
+
+        if not sync_token:
+            return [('full', {'timeMin': now.isoformat(), 'timeMax': horizon_end.isoformat()}, horizon_end)]
+
+        jobs = [('sync', {'syncToken': sync_token}, None)]
+        old_end = self.horizon_ends[calendar_id]
+        if horizon_end - old_end >= HORIZON_STEP:
+            jobs.append(('edge', {'timeMin': old_end.isoformat(), 'timeMax': horizon_end.isoformat()}, horizon_end))
+        return jobs
+
+    def _complete(self, calendar_id: str, kind: str, result: Dict, window_end: datetime.datetime) -> None:
+        """Stages the sync token and the new horizon after the last page of a request, see `commit`"""
+        if kind != 'edge':
+            self._staged_tokens[calendar_id] = result.get('nextSyncToken')
+        if window_end:
+            self._staged_ends[calendar_id] = window_end
+
+    def _events_request(self, calendar_id: str, params: Dict, page_token: str = None):
+        return self.service.events().list(calendarId=calendar_id, singleEvents=True, pageToken=page_token, **params)
+
+    def _sync_token_expired(self, calendar_id: str, error: Exception) -> bool:
+        """Checks for a 410 Gone response to a sync token and drops the token, so the next request is a full sync"""
+        if isinstance(error, HttpError) and error.resp.status == 410 and self.sync_tokens.get(calendar_id):
+            self.sync_tokens.pop(calendar_id)
+            return True
+        return False
@@ -0,0 +1,145 @@
+import bisect
+import contextlib
+import datetime
+import time
+from typing import Callable, Dict, List
+
+from aiohttp import web
+
+
+# upper bounds of the histogram buckets in seconds
+BUCKETS = (0.001, 0.005, 0.01, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+
+class Histogram:
+    def __init__(self, buckets: tuple = BUCKETS):
+        self.buckets = buckets
+        # the last count is for observations above the largest bucket
+        self.counts = [0] * (len(buckets) + 1)
+        self.count = 0
+        self.sum = 0.0
+        self.max = 0.0
+        self.last = 0.0
+
+    def observe(self, value: float) -> None:
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.sum += value
+        self.max = max(self.max, value)
+        self.last = value
+
+    def quantile(self, q: float) -> float:
+        """Upper bound of the bucket the q-quantile falls into"""
+        rank = q * self.count
+        seen = 0
+        for bound, count in zip(self.buckets, self.counts):
+            seen += count
+            if seen >= rank:
+                return min(bound, self.max)
+        return self.max
+
+
+class Metrics:
+    def __init__(self):
+        """Timings and counters of the calendar loop.
+
+        Timings are kept in histograms, counters are either counted here or read from a callback
+        registered with `register` whenever the metrics are shown.
+        """
+        self.histograms: Dict[str, Histogram] = {}
+        self.counters: Dict[str, int] = {}
+        self.callbacks: Dict[str, Callable[[], float]] = {}
+
+    def observe(self, name: str, seconds: float) -> None:
+        histogram = self.histograms.get(name)
+        if histogram is None:
+            histogram = self.histograms[name] = Histogram()
+        histogram.observe(seconds)
+
+    @contextlib.contextmanager
+    def time(self, name: str):
+        """Observes the duration of the with block, also when it raises"""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - start)
+
+    def count(self, name: str, amount: int = 1) -> None:
+        self.counters[name] = self.counters.get(name, 0) + amount
+
+    def register(self, name: str, callback: Callable[[], float]) -> None:
+        """Adds a counter which is kept elsewhere, callback returns its current value"""
+        self.callbacks[name] = callback
+
+    def collect_counters(self) -> Dict[str, float]:
+        counters = dict(self.counters)
+        for name, callback in self.callbacks.items():
+            counters[name] = callback()
+        return counters
+
+    def summary(self) -> List[str]:
+        """Human readable lines for the metrics command"""
+        lines = [f'{"":18} {"Anzahl":>7} {"Ø ms":>8} {"p95 ms":>8} {"max ms":>8}']
+        for name, histogram in sorted(self.histograms.items()):
+            average = histogram.sum / histogram.count if histogram.count else 0
+            lines.append(f'{name:18} {histogram.count:7} {average * 1000:8.1f} {histogram.quantile(0.95) * 1000:8.0f} '
+                         f'{histogram.max * 1000:8.0f}')
+        lines.append('')
+        for name, value in sorted(self.collect_counters().items()):
+            lines.append(f'{name:28} {value}')
+        return lines
+
+    def prometheus(self, prefix: str = 'eitcogs_calendar') -> str:
+        """The metrics in the Prometheus text format"""
+        lines = []
+        for name, histogram in sorted(self.histograms.items()):
+            metric = f'{prefix}_{name}_seconds'
+            lines.append(f'# TYPE {metric} histogram')
+            cumulative = 0
+            for bound, count in zip(self.buckets_with_inf(histogram), histogram.counts):
+                cumulative += count
+                lines.append(f'{metric}_bucket{{le="{bound}"}} {cumulative}')
+            lines.append(f'{metric}_sum {histogram.sum}')
+            lines.append(f'{metric}_count {histogram.count}')
+        for name, value in sorted(self.collect_counters().items()):
+            metric = f'{prefix}_{name}_total'
+            lines.append(f'# TYPE {metric} counter')
+            lines.append(f'{metric} {value}')
+        return '\n'.join(lines) + '\n'
+
+    @staticmethod
+    def buckets_with_inf(histogram: Histogram) -> List[str]:
+        return [str(bound) for bound in histogram.buckets] + ['+Inf']
+
+
+class MetricsServer:
+    def __init__(self, metrics: Metrics, host: str = '0.0.0.0', port: int = 9100, path: str = '/metrics'):
+        """Serves the metrics in the Prometheus text format"""
+        self.metrics = metrics
+        self.host = host
+        self.port = port
+        self.path = path
+        self._runner = None
+
+    async def start(self) -> None:
+        app = web.Application()
+        app.router.add_get(self.path, self.handle)
+        self._runner = web.AppRunner(app)
+        await self._runner.setup()
+        await web.TCPSite(self._runner, self.host, self.port).start()
+
+    async def stop(self) -> None:
+        if self._runner:
+            await self._runner.cleanup()
+            self._runner = None
+
+    async def handle(self, request: web.Request) -> web.Response:
+        return web.Response(text=self.metrics.prometheus(), content_type='text/plain')
+
+
+def loop_lag(loop) -> float:
+    """Seconds the running iteration of a discord.ext.tasks loop started later than it was scheduled"""
+    interval = loop.seconds + loop.minutes * 60 + loop.hours * 3600
+    scheduled = loop.next_iteration - datetime.timedelta(seconds=interval)
+    return max((datetime.datetime.now(datetime.timezone.utc) - scheduled).total_seconds(), 0)
@@ -0,0 +1,162 @@
+import logging
+import time
+from typing import Awaitable, Callable, Dict, List
+
+import discord
+
+from .setup import setup_start, setup_name_error, dialog_timeout, embed_semester_start, embed_group_select, \
+    embed_setup_group_error, embed_setup_end, str_to_role, assign_group
+from .userinput import is_valid_name
+
+
+# steps of an onboarding, a finished onboarding has no record
+AWAITING_NAME = 'name'
+AWAITING_GROUP = 'group'
+
+# invalid answers in a row before an onboarding is dropped
+MAX_ERRORS = 10
+
+
+class Onboarding:
+    def __init__(self, eitcog):
+        """Guides members through the setup: awaiting name -> awaiting group -> done.
+
+        The step of every member is a small record in the config instead of a coroutine waiting for the answer,
+        so pending onboardings cost no task and continue after a reload or restart. The message dispatcher hands
+        the DMs of members with a pending onboarding to `handle`.
+
+        :param eitcog: the EITCogs Object
+        """
+        self.eitcog = eitcog
+        # member id -> {'step', 'asked': time the question of the step was sent, 'errors'}
+        self.pending: Dict[int, Dict] = {}
+        # awaited with the member id whenever a member finished the onboarding
+        self.done_callbacks: List[Callable[[int], Awaitable]] = []
+        # members whose answer is being processed, further messages are ignored meanwhile
+        self._busy = set()
+
+    @property
+    def timeout(self) -> float:
+        return self.eitcog.dispatcher.timeout
+
+    async def load(self) -> None:
+        """Restores the pending onboardings, expired ones are dropped"""
+        records = await self.eitcog.config.custom('Onboarding').all()
+        for member_id, record in records.items():
+            if self._expired(record):
+                await self.eitcog.config.custom('Onboarding', member_id).clear()
+            else:
+                self.pending[int(member_id)] = record
+
+    async def setup(self, member: discord.Member) -> bool:
+        return await self.start(member, AWAITING_NAME, setup_start)
+
+    async def semester_start(self, member: discord.Member) -> bool:
+        return await self.start(member, AWAITING_GROUP, embed_semester_start(self.eitcog.semesters))
+
+    async def change_group(self, member: discord.Member) -> bool:
+        return await self.start(member, AWAITING_GROUP, embed_group_select(member.display_name, self.eitcog.semesters))
+
+    async def start(self, member: discord.Member, step: str, embed: discord.Embed) -> bool:
+        """Sends the question of the step to the member, the answer is handled when it arrives
+
+        :return: False if the member could not be reached
+        """
+        try:
+            await member.send(embed=embed)
+        except (AttributeError, discord.HTTPException):
+            return False
+        await self.begin(member.id, step)
+        return True
+
+    async def begin(self, member_id: int, step: str) -> None:
+        """Waits for the answer to the step, the question has to be sent already"""
+        await self._save(member_id, {'step': step, 'asked': time.time(), 'errors': 0})
+
+    async def cancel(self, member_id: int) -> bool:
+        if member_id not in self.pending:
+            return False
+        await self._finish(member_id, done=False)
+        return True
+
+    async def cancel_all(self) -> int:
+        member_ids = list(self.pending)
+        for member_id in member_ids:
+            await self._finish(member_id, done=False)
+        return len(member_ids)
+
+    def counts(self) -> Dict[str, int]:
+        counts = {AWAITING_NAME: 0, AWAITING_GROUP: 0}
+        for record in self.pending.values():
+            counts[record['step']] += 1
+        return counts
+
+    def wants(self, message: discord.Message) -> bool:
+        return message.guild is None and message.author.id in self.pending
+
+    async def handle(self, message: discord.Message) -> None:
+        member_id = message.author.id
+        if member_id in self._busy:
+            return
+        self._busy.add(member_id)
+        try:
+            record = self.pending[member_id]
+            member = self.eitcog.guild.get_member(member_id)
+            if member is None:
+                await self._finish(member_id, done=False)
+            elif self._expired(record):
+                await self._finish(member_id, done=False)
+                await member.send(embed=dialog_timeout)
+            elif record['step'] == AWAITING_NAME:
+                await self._name(member, record, message.content)
+            else:
+                await self._group(member, record, message.content)
+        except discord.HTTPException as error:
+            print(f'EITBOT: Onboarding of {message.author} failed: {error}')
+        finally:
+            self._busy.discard(member_id)
+
+    async def _name(self, member: discord.Member, record: Dict, answer: str) -> None:
+        if not is_valid_name(answer):
+            await self._invalid(member, record, setup_name_error)
+            return
+
+        # change Users Nickname to tiped name
+        try:
+            await member.edit(nick=answer)
+        except discord.Forbidden:
+            logging.info(f'could not asign new nickname to member "{answer}"')
+
+        await self._save(member.id, {'step': AWAITING_GROUP, 'asked': time.time(), 'errors': 0})
+        await member.send(embed=embed_group_select(answer, self.eitcog.semesters))
+
+    async def _group(self, member: discord.Member, record: Dict, answer: str) -> None:
+        role = str_to_role(answer, self.eitcog)
+        if role is None:
+            await self._invalid(member, record, embed_setup_group_error(answer))
+            return
+
+        await self._finish(member.id, done=True)
+        await assign_group(self.eitcog, member, role)
+        await member.send(embed=embed_setup_end(role.name))
+
+    async def _invalid(self, member: discord.Member, record: Dict, embed: discord.Embed) -> None:
+        if record['errors'] >= MAX_ERRORS:
+            await self._finish(member.id, done=False)
+            return
+        await self._save(member.id, {**record, 'asked': time.time(), 'errors': record['errors'] + 1})
+        await member.send(embed=embed)
+
+    async def _save(self, member_id: int, record: Dict) -> None:
+        self.pending[member_id] = record
+        await self.eitcog.config.custom('Onboarding', str(member_id)).set(record)
+
+    async def _finish(self, member_id: int, done: bool) -> None:
+        self.pending.pop(member_id, None)
+        await self.eitcog.config.custom('Onboarding', str(member_id)).clear()
+        if done:
+            for callback in self.done_callbacks:
+                await callback(member_id)
+
+    def _expired(self, record: Dict) -> bool:
+        return time.time() - record['asked'] > self.timeout
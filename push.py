@@ -0,0 +1,144 @@
+import asyncio
+import secrets
+import time
+from typing import Dict
+
+from aiohttp import web
+from discord.ext import tasks
+from googleapiclient.errors import HttpError
+
+from .metrics import loop_lag
+
+
+class PushReceiver:
+    def __init__(self, callback, host: str = '0.0.0.0', port: int = 8080, path: str = '/calendar/notifications'):
+        """A small webhook server for the push notifications of the Google Calendar API.
+
+        :param callback: coroutine function which is called with the calendar id of every changed calendar
+        :param host: interface the server listens on
+        :param port: port the server listens on
+        :param path: path notifications are posted to
+        """
+        self.callback = callback
+        self.host = host
+        self.port = port
+        self.path = path
+
+        # every notification carries this token, requests without it are rejected
+        self.token = secrets.token_urlsafe(32)
+        # channel id -> calendar id
+        self.channels = {}
+        self._runner = None
+
+    async def start(self) -> None:
+        app = web.Application()
+        app.router.add_post(self.path, self.handle)
+        self._runner = web.AppRunner(app)
+        await self._runner.setup()
+        await web.TCPSite(self._runner, self.host, self.port).start()
+
+    async def stop(self) -> None:
+        if self._runner:
+            await self._runner.cleanup()
+            self._runner = None
+
+    async def handle(self, request: web.Request) -> web.Response:
+        if request.headers.get('X-Goog-Channel-Token') != self.token:
+            return web.Response(status=403)
+
+        calendar_id = self.channels.get(request.headers.get('X-Goog-Channel-ID'))
+        # 'sync' is only sent once when a channel was created
+        if calendar_id and request.headers.get('X-Goog-Resource-State') != 'sync':
+            await self.callback(calendar_id)
+        return web.Response(status=200)
+
+
+class CalendarPush:
+    def __init__(self, manager, address: str, host: str = '0.0.0.0', port: int = 8080,
+                 path: str = '/calendar/notifications', channel_ttl: int = 7 * 24 * 60 * 60,
+                 fallback_interval: int = 900):
+        """Keeps a notification channel open for every subscribed calendar and syncs calendars when they change.
+
+        While all channels are open the calendar is polled at most every fallback_interval seconds,
+        if a channel can't be opened it falls back to the interval of the RefreshPolicy.
+
+        :param manager: the CalendarManager to sync
+        :param address: public https address which is forwarded to the receiver
+        :param channel_ttl: requested lifetime of a channel in seconds, channels are renewed an hour before expiry
+        :param fallback_interval: polling interval in seconds while all channels are open
+        """
+        self.manager = manager
+        self.address = address
+        self.channel_ttl = channel_ttl
+        self.fallback_interval = fallback_interval
+
+        self.receiver = PushReceiver(self.on_change, host, port, path)
+        # calendar id -> channel resource returned by events().watch()
+        self.channels: Dict[str, Dict] = {}
+        self.pending = set()
+        self._flush_task = None
+
+        self.renew = tasks.loop(minutes=30)(self.renew)
+
+    async def start(self) -> None:
+        await self.receiver.start()
+        self.renew.start()
+
+    async def stop(self) -> None:
+        self.renew.cancel()
+        await self.receiver.stop()
+        for channel in self.channels.values():
+            try:
+                await self.manager.run_api(self.manager.fetcher.stop_channel, channel)
+            except HttpError:
+                pass
+        self.channels.clear()
+
+    async def on_change(self, calendar_id: str) -> None:
+        """Collects the changed calendars for a moment, so a burst of notifications results in one sync"""
+        self.pending.add(calendar_id)
+        if self._flush_task is None:
+            self._flush_task = asyncio.create_task(self._flush())
+
+    async def _flush(self) -> None:
+        await asyncio.sleep(1)
+        calendar_ids, self.pending = self.pending, set()
+        self._flush_task = None
+        await self.manager.sync(calendar_ids)
+
+    async def renew(self) -> None:
+        """Opens channels for new calendars, renews expiring channels and closes channels of removed calendars"""
+        self.manager.metrics.observe('lag_renew', loop_lag(self.renew))
+        fetcher = self.manager.fetcher
+        calendar_ids = {calendar_info['id'] for calendar_info in await self.manager.run_api(fetcher.list_calendars)}
+        renew_before = (time.time() + 60 * 60) * 1000
+
+        failed = False
+        for calendar_id in calendar_ids:
+            channel = self.channels.get(calendar_id)
+            if channel and int(channel.get('expiration', 0)) > renew_before:
+                continue
+            try:
+                new_channel = await self.manager.run_api(fetcher.watch, calendar_id, self.address,
+                                                         self.receiver.token, self.channel_ttl)
+            except HttpError as error:
+                print(f'EITBOT: Could not open a notification channel for {calendar_id}: {error}')
+                failed = True
+                continue
+            self.channels[calendar_id] = new_channel
+            self.receiver.channels[new_channel['id']] = calendar_id
+            if channel:
+                await self._close(channel)
+
+        for calendar_id in set(self.channels) - calendar_ids:
+            await self._close(self.channels.pop(calendar_id))
+
+        # poll less often as long as every calendar notifies us about changes
+        self.manager.policy.push_interval = None if failed else self.fallback_interval
+
+    async def _close(self, channel: Dict) -> None:
+        self.receiver.channels.pop(channel['id'], None)
+        try:
+            await self.manager.run_api(self.manager.fetcher.stop_channel, channel)
+        except HttpError as error:
+            print(f'EITBOT: Could not close notification channel {channel["id"]}: {error}')
@@ -0,0 +1,56 @@
+import datetime
+
+
+class RefreshPolicy:
+    def __init__(self, min_interval: int = 60, max_interval: int = 900, lead_time: int = 600, adaptive: bool = True):
+        """Decides when the calendars are fetched next.
+
+        While a reminder is shown or about to start, the calendars are fetched every min_interval seconds.
+        Otherwise the next fetch is timed lead_time seconds before the next reminder starts, but at most
+        max_interval seconds later. Entries added in between are therefore noticed up to max_interval seconds late.
+
+        :param min_interval: interval in seconds close to reminders
+        :param max_interval: upper bound of the interval in seconds, used when no reminder is known
+        :param lead_time: seconds before a reminder from which on the calendars are fetched every min_interval
+        :param adaptive: if False the calendars are always fetched every min_interval seconds
+        """
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.lead_time = lead_time
+        self.adaptive = adaptive
+        # set while push notifications are active, the polling then only serves as a fallback
+        self.push_interval = None
+
+        self.interval = min_interval
+        self.reason = 'Start'
+        self.next_poll = None
+        self.next_reminder = None
+        self.polls = 0
+        self.skipped = 0
+
+    def due(self, now: datetime.datetime) -> bool:
+        if self.next_poll is None or now >= self.next_poll:
+            return True
+        self.skipped += 1
+        return False
+
+    def update(self, next_reminder: datetime.datetime, now: datetime.datetime) -> None:
+        """Plans the next fetch after a fetch, next_reminder is the earliest reminder start of all unfinished entries"""
+        self.polls += 1
+        self.next_reminder = next_reminder
+
+        if not self.adaptive:
+            self.interval, self.reason = self.min_interval, 'festes Intervall'
+        elif next_reminder is None:
+            self.interval, self.reason = self.max_interval, 'keine anstehenden Erinnerungen'
+        else:
+            seconds = (next_reminder - now).total_seconds() - self.lead_time
+            if seconds <= self.min_interval:
+                self.interval, self.reason = self.min_interval, 'Erinnerung steht an'
+            else:
+                self.interval, self.reason = min(int(seconds), self.max_interval), 'bis kurz vor der nächsten Erinnerung'
+
+        if self.push_interval and self.push_interval > self.interval:
+            self.interval, self.reason = self.push_interval, 'Push-Benachrichtigungen aktiv'
+
+        self.next_poll = now + datetime.timedelta(seconds=self.interval)
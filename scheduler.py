@@ -0,0 +1,109 @@
+import asyncio
+import datetime
+import heapq
+from typing import Awaitable, Callable
+
+from .metrics import Metrics
+
+
+# delay until a failed update is retried
+RETRY_DELAY = datetime.timedelta(seconds=60)
+
+
+class ReminderScheduler:
+    def __init__(self, reminders, timezone: datetime.tzinfo, metrics: Metrics = None,
+                 after_batch: Callable[[], Awaitable] = None):
+        """Updates every reminder exactly when its next update is due instead of polling all reminders.
+
+        Deadlines are kept in a heap, a single task sleeps until the earliest one.
+        Rescheduling a reminder does not remove its old heap item, outdated items are skipped when popped.
+
+        :param reminders: the ReminderStore the scheduled ids are looked up in
+        :param timezone: timezone of the reminder deadlines
+        :param metrics: records how late the updates run and how long they take
+        :param after_batch: awaited after all due updates ran, e.g. to save the state once per batch
+        """
+        self.reminders = reminders
+        self.timezone = timezone
+        self.metrics = metrics or Metrics()
+        self.after_batch = after_batch
+
+        self._heap = []
+        self._deadlines = {}
+        self._wakeup = asyncio.Event()
+        self._task = None
+
+    def start(self) -> None:
+        self._task = asyncio.create_task(self._run())
+
+    def cancel(self) -> None:
+        if self._task:
+            self._task.cancel()
+            self._task = None
+
+    def schedule(self, reminder, deadline: datetime.datetime = None) -> None:
+        """(Re)schedules the next update of a reminder, by default when the reminder needs its next update"""
+        if deadline is None:
+            deadline = reminder.next_update(datetime.datetime.now(self.timezone))
+        if deadline is None:
+            self.unschedule(reminder.id)
+        else:
+            self._push(reminder.id, deadline)
+
+    def unschedule(self, entry_id: str) -> None:
+        self._deadlines.pop(entry_id, None)
+
+    def _push(self, entry_id: str, deadline: datetime.datetime) -> None:
+        self._deadlines[entry_id] = deadline
+        heapq.heappush(self._heap, (deadline, entry_id))
+        if self._heap[0][1] == entry_id:
+            self._wakeup.set()
+
+    def next_deadline(self) -> datetime.datetime:
+        """Returns the earliest deadline or None if nothing is scheduled"""
+        while self._heap and self._deadlines.get(self._heap[0][1]) != self._heap[0][0]:
+            heapq.heappop(self._heap)
+        return self._heap[0][0] if self._heap else None
+
+    async def _run(self) -> None:
+        while True:
+            await self._sleep_until_due()
+
+            now = datetime.datetime.now(self.timezone)
+            while self.next_deadline() is not None and self._heap[0][0] <= now:
+                deadline, entry_id = heapq.heappop(self._heap)
+                del self._deadlines[entry_id]
+
+                reminder = self.reminders.get(entry_id)
+                if reminder is None:
+                    continue
+                self.metrics.observe('lag_reminder', (now - deadline).total_seconds())
+                try:
+                    with self.metrics.time('update'):
+                        await reminder.update()
+                except Exception as error:
+                    # any failure only delays this reminder, the loop keeps serving the others
+                    print(f'EITBOT: Could not update the reminder for "{reminder.entry.summary}": {error}')
+                    self._push(entry_id, now + RETRY_DELAY)
+                else:
+                    self.schedule(reminder)
+
+            if self.after_batch:
+                try:
+                    await self.after_batch()
+                except Exception as error:
+                    print(f'EITBOT: Could not finish the reminder updates: {error}')
+
+    async def _sleep_until_due(self) -> None:
+        self._wakeup.clear()
+        deadline = self.next_deadline()
+        if deadline is None:
+            await self._wakeup.wait()
+            return
+
+        delay = (deadline - datetime.datetime.now(self.timezone)).total_seconds()
+        if delay > 0:
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), delay)
+            except asyncio.TimeoutError:
+                pass
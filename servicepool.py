@@ -0,0 +1,73 @@
+import json
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict
+
+import google_auth_httplib2
+import httplib2
+from googleapiclient import discovery_cache
+from googleapiclient.discovery import build_from_document
+
+
+DISCOVERY_URL = 'https://www.googleapis.com/discovery/v1/apis/calendar/v3/rest'
+
+
+class ServicePool:
+    def __init__(self, credentials: Any, max_workers: int = 4,
+                 discovery_path: str = './data/calendar_v3_discovery.json'):
+        """Hands every thread its own calendar service, httplib2 connections must not be shared between threads.
+
+        The services are built from a discovery document which is cached in a local file, so building a service
+        needs no round trip. Per calendar fetches run on the bounded thread pool `executor`.
+
+        :param credentials: google.auth credentials shared by all services
+        :param max_workers: amount of threads fetching calendars concurrently
+        :param discovery_path: file the discovery document of the calendar API is cached in
+        """
+        self.credentials = credentials
+        self.max_workers = max_workers
+        self.discovery_path = discovery_path
+        self.executor = ThreadPoolExecutor(max_workers, thread_name_prefix='calendar')
+
+        self._document = None
+        self._document_lock = threading.Lock()
+        self._local = threading.local()
+
+    def service(self) -> Any:
+        """Returns the service of the current thread"""
+        service = getattr(self._local, 'service', None)
+        if service is None:
+            http = google_auth_httplib2.AuthorizedHttp(self.credentials, http=httplib2.Http())
+            service = self._local.service = build_from_document(self.discovery_document(), http=http)
+        return service
+
+    def discovery_document(self) -> Dict:
+        with self._document_lock:
+            if self._document is None:
+                self._document = self._load_document()
+            return self._document
+
+    def shutdown(self) -> None:
+        self.executor.shutdown(wait=False)
+
+    def _load_document(self) -> Dict:
+        if os.path.exists(self.discovery_path):
+            with open(self.discovery_path, 'r') as file:
+                return json.load(file)
+
+        # googleapiclient 2 ships the document, older versions have to download it
+        document = discovery_cache.get_static_doc('calendar', 'v3') if hasattr(discovery_cache, 'get_static_doc') \
+            else None
+        if document is None:
+            response, document = httplib2.Http().request(DISCOVERY_URL)
+            if response.status != 200:
+                raise RuntimeError(f'Could not download the discovery document: {response.status}')
+            document = document.decode()
+
+        try:
+            with open(self.discovery_path, 'w') as file:
+                file.write(document)
+        except OSError as error:
+            print(f'EITBOT: Could not cache the discovery document: {error}')
+        return json.loads(document)
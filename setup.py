@@ -1,11 +1,8 @@
 from __future__ import annotations
-import logging
 from typing import List
 
 import discord
 
-from .userinput import userinput_loop, is_valid_name
-
 setup_start = discord.Embed(description="Willkommen auf unserem Elektrotechnik Discord Server! :wave:  \n\n"
                                         "Dieses Setup ist dafür da, damit wir und deine Kommilitonen "
                                         "dich auf dem Server "
@@ -26,6 +23,11 @@ setup_name_error = discord.Embed(description="Hoppla!\n"
                                  colour=discord.Colour(0x2fb923),
                                  title="Value Error")
 
+dialog_timeout = discord.Embed(description="Das Setup wurde beendet, weil du zu lange nicht geantwortet hast.\n"
+                                           "Du kannst es jederzeit mit **!setup** neu starten.",
+                               colour=discord.Colour(0x2fb923),
+                               title="Timeout")
+
 
 def embed_semester_start(semesters: List) -> discord.Embed:
     embed = discord.Embed(description="Hallo liebe Kommilitonen und Kommilitoninnen!\n\n"
@@ -96,39 +98,16 @@ def embed_setup_end(study_group_name: str) -> discord.Embed:
     return embed
 
 
-async def setup_dialog(eitcog, member: discord.Member) -> None:
-    try:
-        await member.send(embed=setup_start)
-    except (AttributeError, discord.HTTPException):
-        return
-    answer = await userinput_loop(eitcog, member, member.dm_channel,
-                                  filterfunc=is_valid_name, error_embed=setup_name_error)
-    # change Users Nickname to tiped name
-    try:
-        await member.edit(nick=answer)
-    except discord.Forbidden:
-        logging.info(f'could not asign new nickname to member "{answer}"')
-
-    await member.send(embed=embed_group_select(answer, eitcog.semesters))
-    await group_selection(eitcog, member)
-
-
-async def semester_start_dialog(eitcog, member: discord.Member) -> None:
-    try:
-        await member.send(embed=embed_semester_start(eitcog.semesters))
-    except AttributeError as error:
-        print(error)
-    except discord.HTTPException as error:
-        print(error)
-
-    await group_selection(eitcog, member)
-
+def str_to_role(answer, eitcog):
+    for name, role in eitcog.roles.items():
+        if answer.lower() == name.lower():
+            return role
+    for group in eitcog.groups:
+        if answer.upper() in group.name.upper():
+            return group.role
 
-async def group_selection(eitcog, member: discord.Member) -> None:
-    # loop until User tiped in a valid studygroup
-    role = await userinput_loop(eitcog, member, member.dm_channel,
-                                converter=str_to_role, error_embed=embed_setup_group_error)
 
+async def assign_group(eitcog, member: discord.Member, role: discord.Role) -> None:
     await remove_groups(eitcog, member)
     await member.add_roles(role)
 
@@ -137,18 +116,6 @@ async def group_selection(eitcog, member: discord.Member) -> None:
     else:
         await member.add_roles(eitcog.roles['Student'])
 
-    await member.send(embed=embed_setup_end(role.name))
-    return
-
-
-def str_to_role(answer, eitcog):
-    for name, role in eitcog.roles.items():
-        if answer.lower() == name.lower():
-            return role
-    for group in eitcog.groups:
-        if answer.upper() in group.name.upper():
-            return group.role
-
 
 async def remove_groups(eitcog, member: discord.Member) -> None:
     for role in member.roles:
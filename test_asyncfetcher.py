@@ -0,0 +1,88 @@
+import datetime
+import unittest
+
+import httplib2
+from googleapiclient.errors import HttpError
+
+from .asyncfetcher import AsyncCalendarFetcher
+from .fakeservice import FakeCalendarServer, FakeCalendarService, FakeCredentials, fake_entry
+
+
+class TestAsyncCalendarFetcher(unittest.IsolatedAsyncioTestCase):
+    async def asyncSetUp(self) -> None:
+        self.service = FakeCalendarService(calendars=5, entries_per_calendar=3, latency=0)
+        self.server = FakeCalendarServer(self.service)
+        await self.server.start()
+        # revalidate the calendar list on every fetch
+        self.fetcher = AsyncCalendarFetcher(FakeCredentials(), calendar_list_ttl=0, base_url=self.server.url)
+
+    async def asyncTearDown(self) -> None:
+        await self.fetcher.close()
+        await self.server.stop()
+
+    async def test_full_sync(self):
+        synced = await self.fetcher.fetch()
+        self.assertEqual(len(synced), 5)
+        for calendar_info, raw_entries, full_sync in synced:
+            self.assertTrue(full_sync)
+            self.assertEqual(len(raw_entries), 3)
+            self.assertIn(calendar_info['id'], self.fetcher.sync_tokens)
+
+    async def test_incremental_sync(self):
+        await self.fetcher.fetch()
+        calendar_id = self.service.calendars[2]['id']
+        start = datetime.datetime.utcnow() + datetime.timedelta(hours=2)
+        self.service.update_entry(calendar_id, fake_entry('new', 'BAC2A-Kurs2', start))
+
+        synced = {calendar_info['id']: (raw_entries, full_sync)
+                  for calendar_info, raw_entries, full_sync in await self.fetcher.fetch()}
+        self.assertEqual(synced.pop(calendar_id), ([self.service.entries[calendar_id]['new']], False))
+        for raw_entries, full_sync in synced.values():
+            self.assertEqual(raw_entries, [])
+            self.assertFalse(full_sync)
+
+    async def test_expired_sync_token(self):
+        await self.fetcher.fetch()
+        self.service.expire_sync_tokens()
+
+        # 410 Gone: the calendars are synced again from scratch
+        for calendar_info, raw_entries, full_sync in await self.fetcher.fetch():
+            self.assertTrue(full_sync)
+            self.assertEqual(len(raw_entries), 3)
+
+        for calendar_info, raw_entries, full_sync in await self.fetcher.fetch():
+            self.assertFalse(full_sync)
+
+    async def test_calendar_list_not_modified(self):
+        await self.fetcher.fetch()
+        calendars = self.fetcher.calendars
+        requests = self.service.requests
+
+        # 304 Not Modified: the cached list is kept
+        self.assertIs(await self.fetcher.list_calendars(), calendars)
+        self.assertEqual(self.service.requests, requests + 1)
+
+        self.service.calendars.append({'id': 'new@group.calendar.google.com', 'summary': 'BAC9A-Neu'})
+        self.assertEqual(len(await self.fetcher.list_calendars()), 6)
+
+    async def test_failed_calendar_keeps_the_changes(self):
+        await self.fetcher.fetch()
+        changed_id, failing_id = self.service.calendars[0]['id'], self.service.calendars[1]['id']
+        start = datetime.datetime.utcnow() + datetime.timedelta(hours=2)
+        self.service.update_entry(changed_id, fake_entry('new', 'BAC2A-Kurs2', start))
+
+        list_events = self.service._list_events
+        failures = [HttpError(httplib2.Response({'status': 503}), b'')]
+
+        def failing_list_events(calendarId, **kwargs):
+            if calendarId == failing_id and failures:
+                raise failures.pop()
+            return list_events(calendarId=calendarId, **kwargs)
+        self.service._list_events = failing_list_events
+
+        with self.assertRaises(HttpError):
+            await self.fetcher.fetch()
+
+        # the sync tokens of the other calendars were not committed, the change is fetched again
+        synced = {calendar_info['id']: raw_entries for calendar_info, raw_entries, _ in await self.fetcher.fetch()}
+        self.assertEqual(synced[changed_id], [self.service.entries[changed_id]['new']])
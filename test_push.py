@@ -0,0 +1,60 @@
+import asyncio
+import socket
+import unittest
+
+from .calendar import CalendarManager
+from .fakeservice import FakeCalendarService
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+class TestPushReceiver(unittest.IsolatedAsyncioTestCase):
+    async def asyncSetUp(self) -> None:
+        self.service = FakeCalendarService(calendars=5, entries_per_calendar=3, latency=0)
+        port = free_port()
+        self.manager = CalendarManager(None, service=self.service, push_port=port,
+                                       push_address=f'http://127.0.0.1:{port}/calendar/notifications')
+
+        # wait for the first sync and the notification channels
+        while len(self.service.watch_channels) < 5:
+            await asyncio.sleep(0.01)
+        async with self.manager.sync_lock:
+            pass
+
+        self.synced = []
+        fetch = self.manager.fetcher.fetch
+
+        def recording_fetch(calendar_ids=None, commit=True):
+            result = fetch(calendar_ids, commit)
+            self.synced.append([calendar_info['id'] for calendar_info, _, _ in result])
+            return result
+        self.manager.fetcher.fetch = recording_fetch
+
+    async def asyncTearDown(self) -> None:
+        await self.manager.stop()
+
+    async def test_notification_syncs_the_calendar(self):
+        calendar_id = self.service.calendars[3]['id']
+        self.assertEqual(await self.service.notify(calendar_id), [200])
+
+        # notifications are collected for a second before the sync
+        await asyncio.sleep(1.2)
+        async with self.manager.sync_lock:
+            pass
+        self.assertEqual(self.synced, [[calendar_id]])
+
+    async def test_sync_message_is_ignored(self):
+        self.assertEqual(await self.service.notify(self.service.calendars[0]['id'], state='sync'), [200])
+        await asyncio.sleep(1.2)
+        self.assertEqual(self.synced, [])
+
+    async def test_wrong_token_is_rejected(self):
+        for calendar_id, channel in self.service.watch_channels.values():
+            channel['token'] = 'wrong'
+        self.assertEqual(await self.service.notify(self.service.calendars[0]['id']), [403])
+        await asyncio.sleep(1.2)
+        self.assertEqual(self.synced, [])
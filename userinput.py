@@ -1,12 +1,121 @@
 from __future__ import annotations
 
 import asyncio
-from typing import Any
+import time
+from typing import Any, Dict, List, Optional, Tuple
 
 import discord
 
 
-ongoing = []
+# seconds a dialog waits for an answer before it is closed
+DEFAULT_TIMEOUT = 24 * 60 * 60
+
+# seconds cached prefixes are used, catches prefix changes the resolver is not told about
+PREFIX_TTL = 5 * 60
+
+# Red commands which change the prefixes
+PREFIX_COMMANDS = ('set prefix', 'set serverprefix', 'set globalprefix')
+
+
+class DialogClosed(Exception):
+    def __init__(self, reason: str):
+        """Raised by UserInput.userinput when the dialog was closed before the user answered
+
+        :param reason: 'timeout', 'replaced' by a newer dialog with the same user and channel or 'cancelled'
+        """
+        super().__init__(reason)
+        self.reason = reason
+
+
+class PrefixResolver:
+    def __init__(self, bot, ttl: int = PREFIX_TTL):
+        """Caches the command prefixes of the bot per guild, Red looks them up in its Config on every call
+
+        :param bot: the bot, its command_prefix is only awaited when the cache of a guild is missing or expired
+        :param ttl: seconds the prefixes of a guild are cached
+        """
+        self.bot = bot
+        self.ttl = ttl
+        # guild id (None for DMs) -> (expiry, prefixes)
+        self._cache: Dict[Optional[int], Tuple[float, Tuple[str, ...]]] = {}
+
+    async def prefixes(self, message: discord.Message) -> Tuple[str, ...]:
+        key = message.guild.id if getattr(message, 'guild', None) else None
+        cached = self._cache.get(key)
+        if cached is not None and cached[0] > time.monotonic():
+            return cached[1]
+        prefixes = await self.bot.command_prefix(self.bot, message)
+        prefixes = (prefixes,) if isinstance(prefixes, str) else tuple(prefixes)
+        self._cache[key] = (time.monotonic() + self.ttl, prefixes)
+        return prefixes
+
+    async def is_command(self, message: discord.Message) -> bool:
+        return message.content.startswith(await self.prefixes(message))
+
+    def invalidate(self) -> None:
+        self._cache.clear()
+
+    async def on_command_completion(self, context) -> None:
+        if context.command.qualified_name in PREFIX_COMMANDS:
+            self.invalidate()
+
+
+class MessageDispatcher:
+    def __init__(self, bot, timeout: int = DEFAULT_TIMEOUT):
+        """Routes incoming messages to the dialogs waiting for them with one listener for all dialogs
+
+        :param bot: the bot, its command prefixes are looked up for messages of waiting users only
+        :param timeout: seconds a dialog waits for an answer before it is closed
+        """
+        self.bot = bot
+        self.timeout = timeout
+        self.prefixes = PrefixResolver(bot)
+        # (user id, channel id) -> the UserInput waiting for the next message of this user in this channel
+        self.waiting: Dict[Tuple[int, int], UserInput] = {}
+        # reason -> amount of dialogs closed for it, 'answered' for the regular ones
+        self.closed: Dict[str, int] = {}
+        # get the messages no dialog waits for if handler.wants(message), e.g. the onboarding
+        self.handlers: List = []
+
+    async def on_message(self, message: discord.Message) -> None:
+        userinput = self.waiting.get((message.author.id, message.channel.id))
+        if userinput is None:
+            handler = next((handler for handler in self.handlers if handler.wants(message)), None)
+            if handler is None:
+                return
+        # commands are handled by the bot, not passed to the dialog
+        if await self.prefixes.is_command(message):
+            return
+        if userinput is None:
+            await handler.handle(message)
+        else:
+            await userinput.queue.put(message)
+
+    def register(self, userinput: UserInput) -> None:
+        """Lets the dialog receive the messages of its user and channel, an older dialog with the same key is closed"""
+        old = self.waiting.get(userinput.key)
+        if old is not None:
+            old.close('replaced')
+        self.waiting[userinput.key] = userinput
+
+    def unregister(self, userinput: UserInput, reason: str = 'answered') -> None:
+        if self.waiting.get(userinput.key) is userinput:
+            del self.waiting[userinput.key]
+            self.closed[reason] = self.closed.get(reason, 0) + 1
+
+    def cancel(self, user_id: int = None) -> int:
+        """Closes the dialogs of a user, all dialogs without user_id
+
+        :return: the amount of closed dialogs
+        """
+        userinputs = [userinput for key, userinput in self.waiting.items() if user_id is None or key[0] == user_id]
+        for userinput in userinputs:
+            userinput.close('cancelled')
+        return len(userinputs)
+
+    def oldest(self, amount: int = 10) -> List[UserInput]:
+        # dicts keep the insertion order, so the first dialogs are the oldest
+        return [userinput for _, userinput in zip(range(amount), self.waiting.values())]
 
 
 class UserInput:
@@ -22,88 +131,55 @@ class UserInput:
         self.user = user
         self.channel = channel
         self.queue = asyncio.Queue()
+        self.started = time.monotonic()
 
-        eitcog.bot.add_listener(self.on_message)
+    @property
+    def key(self) -> Tuple[int, int]:
+        return self.user.id, self.channel.id
 
-    def __eq__(self, other: UserInput) -> bool:
-        if self.channel == other.channel and self.user == other.user:
-            return True
+    @property
+    def age(self) -> float:
+        """Seconds since the dialog started waiting"""
+        return time.monotonic() - self.started
 
     @classmethod
     async def userinput(cls, eitcog, user: [discord.User, discord.Member],
-                        channel: discord.TextChannel, only_content=False) -> Any:
-        """
+                        channel: discord.TextChannel, only_content=False, timeout: float = None) -> Any:
+        """Waits for the next message of the user in the channel
 
         :param eitcog: the EITCogs Object
         :param user: the user
         :param channel:
         :param only_content:
+        :param timeout: seconds to wait for the answer, the timeout of the dispatcher by default
         :return:
+        :raises DialogClosed: if there was no answer within the timeout or the dialog was replaced or cancelled
         """
 
         new_ui = cls(eitcog, user, channel)
-
-        # check if ongoing userinput already exists for given member and channel
-        for ui in ongoing:
-            if ui == new_ui:
-                ui.delete()
-
-        ongoing.append(new_ui)
-        answer = await new_ui.queue.get()
-        new_ui.delete()
+        dispatcher = eitcog.dispatcher
+
+        # replaces an ongoing userinput for given member and channel
+        dispatcher.register(new_ui)
+        reason = 'answered'
+        try:
+            answer = await asyncio.wait_for(new_ui.queue.get(), timeout or dispatcher.timeout)
+        except asyncio.TimeoutError:
+            reason = 'timeout'
+            raise DialogClosed(reason)
+        finally:
+            dispatcher.unregister(new_ui, reason)
+
+        if isinstance(answer, DialogClosed):
+            raise answer
         if only_content:
             return answer.content
         return answer
 
-    def delete(self):
-        self.eitcog.bot.remove_listener(self.on_message)
-        ongoing.remove(self)
-
-    async def on_message(self, message: discord.Message):
-        if await self.command_invoke(self.eitcog.bot, message):
-            return
-        elif message.author.id == self.user.id and message.channel == self.channel:
-            await self.queue.put(message)
-
-    @staticmethod
-    async def command_invoke(bot, message: discord.Message) -> bool:
-        prefixes = await bot.command_prefix(bot, message)
-        for prefix in prefixes:
-            if message.content.startswith(prefix):
-                return True
-
-
-async def userinput_loop(eitcog, user, channel, filterfunc=None,
-                         converter=None, max_repetitions=10, error_embed=None, **kwargs) -> Any:
-    """
-
-    :param eitcog:
-    :param user:
-    :param channel:
-    :param filterfunc:
-    :param converter:
-    :param max_repetitions:
-    :param error_embed:
-    :param kwargs:
-    :return:
-    """
-    counter = 0
-    while counter < (max_repetitions + 1):
-        answer = await UserInput.userinput(eitcog, user, channel)
-        content = answer.content
-        if filterfunc is not None:
-            if filterfunc(content, **kwargs):
-                return answer.content
-        elif converter:
-            output = converter(content, eitcog)
-            if output:
-                return output
-        if error_embed:
-            if callable(error_embed):
-                await user.send(embed=error_embed(content))
-            else:
-                await user.send(embed=error_embed)
-        counter += 1
+    def close(self, reason: str) -> None:
+        """Ends the wait of the dialog, userinput raises DialogClosed with the reason"""
+        self.eitcog.dispatcher.unregister(self, reason)
+        self.queue.put_nowait(DialogClosed(reason))
 
 
 def is_valid_name(name: str) -> bool:
@@ -1,6 +1,14 @@
+import datetime
+from typing import List
+
 import discord
 
 
+# Discord bulk deletes at most 100 messages at once and only messages younger than 14 days
+BULK_DELETE_LIMIT = 100
+BULK_DELETE_MAX_AGE = datetime.timedelta(days=14) - datetime.timedelta(minutes=5)
+
+
 async def toggle_role(member: discord.Member, role: discord.Role) -> None:
     """Gives/removes the specified role to/from the specified member"""
     if role in member.roles:
@@ -24,6 +32,45 @@ async def send_more(messageable: discord.object, content: str) -> None:
             return
 
 
+async def delete_messages(channel: discord.TextChannel, messages: List[discord.abc.Snowflake]) -> int:
+    """Deletes messages of one channel with as few requests as possible, messages which are already gone are ignored.
+
+    Falls back to deleting the messages one by one if they are too old or the bot may not bulk delete.
+
+    Returns
+    -------
+    The amount of messages which were deleted
+    """
+    now = datetime.datetime.now(datetime.timezone.utc)
+    bulk = []
+    single = []
+    for message in messages:
+        created = discord.utils.snowflake_time(message.id)
+        if created.tzinfo is None:
+            created = created.replace(tzinfo=datetime.timezone.utc)
+        (bulk if now - created < BULK_DELETE_MAX_AGE else single).append(message)
+
+    deleted = 0
+    for i in range(0, len(bulk), BULK_DELETE_LIMIT):
+        chunk = bulk[i:i + BULK_DELETE_LIMIT]
+        if len(chunk) < 2:
+            single.extend(chunk)
+            continue
+        try:
+            await channel.delete_messages(chunk)
+            deleted += len(chunk)
+        except discord.HTTPException:
+            single.extend(chunk)
+
+    for message in single:
+        try:
+            await message.delete()
+            deleted += 1
+        except discord.NotFound:
+            pass
+    return deleted
+
+
 def codeblock(string: str) -> str:
     """Wraps a string into a codeblock"""
     return f'```{string}```'